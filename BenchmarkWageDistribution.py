@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from GeneratePayrollRegister import generate_register
+from WageDistribution import AllocationRules, allocate_payroll, load_register, parse_employees, print_report
+
+# Times each stage of WageDistribution.py on generated registers of growing size, so a stage that
+# stops scaling linearly shows up as a jump in its time per employee.
+
+default_sizes = [50, 500, 5000, 50000]
+
+stages = ['load', 'parse', 'allocate', 'report']
+
+
+def benchmark_register(path, rules, engine='auto', repeat=1):
+    # Best time of each stage over repeat runs, in seconds. Also returns the number of rows and the engine used.
+    best = {stage: float('inf') for stage in stages}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        excel_file, load_engine = load_register(path, engine=engine)
+        loaded = time.perf_counter()
+
+        messages = []
+        employees, grand_total, total_futa = parse_employees(excel_file, messages)
+        parsed = time.perf_counter()
+
+        result = allocate_payroll(employees, grand_total, total_futa, rules, messages)
+        allocated = time.perf_counter()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            print_report(result)
+        reported = time.perf_counter()
+
+        timings = {'load': loaded - start, 'parse': parsed - loaded, 'allocate': allocated - parsed, 'report': reported - allocated}
+        for stage in stages:
+            best[stage] = min(best[stage], timings[stage])
+    return best, len(excel_file), load_engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark WageDistribution.py stage by stage on generated registers.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='Employee counts to benchmark (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size, the best time is kept (default: %(default)s)')
+    parser.add_argument('--engine', choices=['auto', 'calamine', 'openpyxl', 'pandas'], default='auto', help='Workbook engine passed to load_register')
+    parser.add_argument('--rules', default=None, help='Rules file to allocate with (defaults to WageDistributionRules.json)')
+    parser.add_argument('--keep-dir', default=None, help='Directory to write the generated registers to and reuse them from, instead of a temporary directory')
+    args = parser.parse_args(argv)
+
+    rules = AllocationRules.load(args.rules) if args.rules else AllocationRules.load()
+
+    with contextlib.ExitStack() as stack:
+        register_dir = args.keep_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(register_dir, exist_ok=True)
+
+        header = f"{'employees':>10} {'rows':>9} {'engine':>9}" + "".join(f" {stage + ' s':>10}" for stage in stages) + f" {'total s':>10} {'us/employee':>12}"
+        print(header)
+        print('-' * len(header))
+        for size in args.sizes:
+            path = os.path.join(register_dir, f"register_{size}.xlsx")
+            if not os.path.exists(path):
+                generate_register(path, size, seed=size)
+
+            best, n_rows, load_engine = benchmark_register(path, rules, engine=args.engine, repeat=args.repeat)
+            total = sum(best.values())
+            print(f"{size:>10} {n_rows:>9} {load_engine:>9}" + "".join(f" {best[stage]:>10.3f}" for stage in stages) + f" {total:>10.3f} {total / size * 1e6:>12.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,173 @@
+import argparse
+import random
+
+from WageDistribution import (
+    deductions_col,
+    department_title_col,
+    employee_name_col,
+    employee_total_col,
+    employer_tax_col,
+    futa_col,
+    grand_total_col,
+    grand_total_net_col,
+    gross_pay_col,
+    hours_worked_col,
+    net_pay_col,
+    program_col,
+    taxes_col,
+)
+
+# Writes made up payroll registers in the same layout as the real export, so we can benchmark and test
+# WageDistribution.py without sharing registers that have real employees in them.
+
+# a few spare columns past the last one we read, like the real export
+register_width = employer_tax_col + 5
+
+# department titles as they show up in column F
+departments = ['Gymnastics', 'Dance', 'TumbleBunnies Preschool', 'Swim', 'Events', 'Admin', 'TAG', 'Team', 'Hospitality', 'Polka Dots', 'Maintenance']
+
+# pay categories as they show up in column B
+pay_categories = ['Gymnastics', 'Dance', 'Swim', 'Events', 'Admin', 'TAG', 'Team', 'Tumblebunny', 'Hospitality', 'Polka Dots Class', 'Maintenance',
+                  'Manage', 'Mentor', 'Full Class', 'Training', 'Overtime', 'Private Lessons', 'Senior Coach', 'Sick', 'Split Shift Premium',
+                  'Trainer', 'Summer Camps', 'Kids Night Out', 'Clean - Gym', 'Team Coach Fee']
+
+# categories paid without hours
+bonus_categories = ['Bonus', 'Gift Cards or $$']
+
+# employer tax lines under every employee, as (label, rate of gross pay)
+employer_tax_rates = [('FICA', 0.062), ('MEDI', 0.0145), ('FUTA', 0.006), ('CA SUI', 0.034), ('CA ETT', 0.001)]
+
+
+def money(amount, rng):
+    # the export is not consistent about thousands separators, neither are we
+    return f"{amount:,.2f}" if rng.random() < 0.5 else f"{amount:.2f}"
+
+
+def generate_rows(n_employees, seed=0):
+    # Yields the rows of a register with n_employees employees, spread evenly over the departments.
+    rng = random.Random(seed)
+
+    def blank_row():
+        return [None] * register_width
+
+    totals = {'gross': 0, 'taxes': 0, 'deductions': 0, 'employer_taxes': 0, 'futa': 0, 'ca_ett': 0, 'net': 0}
+
+    title = blank_row()
+    title[0] = 'Payroll Register'
+    yield title
+
+    employee_number = 0
+    for department_number, department in enumerate(departments):
+        department_size = n_employees * (department_number + 1) // len(departments) - n_employees * department_number // len(departments)
+        if department_size == 0:
+            continue
+
+        department_row = blank_row()
+        department_row[department_title_col] = department
+        yield department_row
+
+        for _ in range(department_size):
+            employee_number += 1
+
+            programs = []
+            for category in rng.sample(pay_categories, rng.randint(1, 4)):
+                hours = round(rng.uniform(1, 40), 2)
+                programs.append((category, hours, round(hours * rng.uniform(16, 30), 2)))
+            if rng.random() < 0.1:
+                programs.append((rng.choice(bonus_categories), None, round(rng.uniform(20, 200), 2)))
+            no_earnings = rng.random() < 0.02
+
+            gross = round(sum(program_gross for _, _, program_gross in programs), 2)
+            taxes = round(gross * rng.uniform(0.05, 0.2), 2)
+            deductions = rng.choice([0, 0, 0, 10.0, 25.5]) if gross > 100 else 0
+            net = round(gross - taxes - deductions, 2)
+            employer_taxes = [(label, round(gross * rate, 2)) for label, rate in employer_tax_rates]
+
+            # Program names line up with their pay, unless the employee has very few programs. Then the export
+            # sometimes pushes the names down a row, which is the quirk the parser's name offset search handles.
+            name_offset = 1 if len(programs) <= 2 and rng.random() < 0.5 else 0
+            block = [blank_row() for _ in range(max(2 + len(programs) + name_offset, 1 + len(employer_taxes)))]
+
+            block[0][program_col] = f"Emp #: {100000 + employee_number}"
+            block[0][employee_name_col] = f"EMPLOYEE {employee_number:06d}"
+            block[1][net_pay_col] = money(net, rng)
+            for i, (category, hours, program_gross) in enumerate(programs):
+                if not no_earnings:
+                    block[2 + i][hours_worked_col] = hours
+                    block[2 + i][gross_pay_col] = money(program_gross, rng)
+                block[2 + i + name_offset][program_col] = category
+            for i, (label, amount) in enumerate(employer_taxes):
+                block[1 + i][futa_col] = label
+                block[1 + i][employer_tax_col] = amount
+            yield from block
+
+            employee_total = blank_row()
+            employee_total[employee_total_col] = 'Employee Tot:'
+            if no_earnings:
+                employee_total[gross_pay_col] = 0
+            else:
+                employee_total[gross_pay_col] = money(gross, rng)
+                employee_total[taxes_col] = taxes
+                employee_total[deductions_col] = deductions
+                employee_total[employer_tax_col] = round(sum(amount for _, amount in employer_taxes), 2)
+
+                totals['gross'] += gross
+                totals['taxes'] += taxes
+                totals['deductions'] += deductions
+                totals['employer_taxes'] += employee_total[employer_tax_col]
+                totals['futa'] += dict(employer_taxes)['FUTA']
+                totals['ca_ett'] += dict(employer_taxes)['CA ETT']
+                totals['net'] += net
+            yield employee_total
+            yield blank_row()
+
+    # GRAND TOTAL: the stated totals, with FUTA and CA ETT listed under it and the net pay two rows down
+    grand_total = blank_row()
+    grand_total[grand_total_col] = 'Grand Tot:'
+    grand_total[gross_pay_col] = money(round(totals['gross'], 2), rng)
+    grand_total[taxes_col] = round(totals['taxes'], 2)
+    grand_total[deductions_col] = round(totals['deductions'], 2)
+    grand_total[employer_tax_col] = round(totals['employer_taxes'], 2)
+    grand_total[futa_col] = 'FICA'
+    yield grand_total
+
+    futa = blank_row()
+    futa[futa_col] = 'FUTA'
+    futa[employer_tax_col] = round(totals['futa'], 2)
+    yield futa
+
+    ca_ett = blank_row()
+    ca_ett[grand_total_net_col] = money(round(totals['net'], 2), rng)
+    ca_ett[futa_col] = 'CA ETT'
+    ca_ett[employer_tax_col] = round(totals['ca_ett'], 2)
+    yield ca_ett
+
+
+def generate_register(path, n_employees, seed=0):
+    # Write a register to path (.xlsx). Returns the number of rows written.
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    n_rows = 0
+    for row in generate_rows(n_employees, seed):
+        worksheet.append(row)
+        n_rows += 1
+    workbook.save(path)
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a made up payroll register in the layout WageDistribution.py reads.')
+    parser.add_argument('output_file', help='Path of the .xlsx file to write')
+    parser.add_argument('--employees', type=int, default=50, help='Number of employees (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed always writes the same register (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    n_rows = generate_register(args.output_file, args.employees, args.seed)
+    print(f"Wrote {args.employees} employees ({n_rows} rows) to '{args.output_file}'")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,133 @@
+import argparse
+import os
+
+from WageDistribution import (
+    PayrollStore,
+    allocation_measures,
+    default_min_change,
+    default_min_change_pct,
+    default_store_file,
+    period_diff,
+    print_period_diff,
+)
+
+# Year to date, quarterly and per-program totals from the store WageDistribution.py --store records into.
+# Nothing here reads a register, every number comes from what was recorded.
+
+
+def latest_year(store):
+    periods = store.periods()
+    pay_dates = periods['pay_date'].dropna()
+    return int(pay_dates.max()[:4]) if len(pay_dates) else None
+
+
+def with_total_row(table, label_column):
+    # adds a TOTAL row with the sum of every measure
+    if len(table) == 0:
+        return table
+    labels = {column: '' for column in table.columns if column not in allocation_measures}
+    table.loc[len(table)] = {**labels, label_column: 'TOTAL', **table[allocation_measures].sum().to_dict()}
+    return table
+
+
+def selected_periods(store, year=None, quarter=None, through=None):
+    # names of the recorded periods paid in the year, quarter and through given, by pay date. Like rollup, periods without
+    # a pay date only count when none of those are given.
+    periods = store.periods()
+    if year is not None or quarter is not None or through is not None:
+        periods = periods[periods['pay_date'].notna()]
+        if year is not None:
+            periods = periods[periods['pay_date'].str[:4] == f"{year:04d}"]
+        if quarter is not None:
+            periods = periods[(periods['pay_date'].str[5:7].astype(int) + 2) // 3 == quarter]
+        if through is not None:
+            periods = periods[periods['pay_date'] <= through]
+    return periods['period'].tolist()
+
+
+def diff_pairs(periods, from_period=None, to_period=None, every_period=False):
+    # the (previous period, period) pairs to compare. Raises ValueError for a period that isn't recorded.
+    for period in [from_period, to_period]:
+        if period is not None and period not in periods:
+            raise ValueError(f"'{period}' is not a recorded pay period")
+    if every_period:
+        return list(zip(periods, periods[1:]))
+    to_period = to_period or (periods[-1] if periods else None)
+    if from_period is None:
+        position = periods.index(to_period) if to_period is not None else 0
+        from_period = periods[position - 1] if position > 0 else None
+    return [(from_period, to_period)] if from_period is not None and to_period is not None else []
+
+
+def print_table(table, title, index=False):
+    print(f"\n{title}:\n")
+    if len(table) == 0:
+        print("\tNothing recorded.")
+        return
+    print(table.round(2).to_string(index=index))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Year to date, quarterly and per-program payroll totals from the WageDistribution.py store.')
+    parser.add_argument('report', choices=['periods', 'ytd', 'quarters', 'programs', 'employees', 'diff'],
+                        help='periods: what is recorded. ytd: per program totals for a year. quarters: one measure per quarter and program. '
+                             'programs: one measure per pay period and program. employees: per employee totals. '
+                             'diff: what changed per employee and program from one pay period to the next')
+    parser.add_argument('--store', default=default_store_file, help='Store to read (default: %(default)s)')
+    parser.add_argument('--year', type=int, default=None, help='Only periods paid in this year (ytd defaults to the latest year recorded)')
+    parser.add_argument('--quarter', type=int, choices=[1, 2, 3, 4], default=None, help='Only periods paid in this quarter')
+    parser.add_argument('--through', default=None, help='Only periods paid on or before this date, YYYY-MM-DD')
+    parser.add_argument('--measure', choices=allocation_measures, default='gross', help='Amount shown by quarters and programs (default: %(default)s)')
+    parser.add_argument('--from', dest='from_period', default=None, help='diff: the earlier period (defaults to the one before --to)')
+    parser.add_argument('--to', dest='to_period', default=None, help='diff: the later period (defaults to the latest one)')
+    parser.add_argument('--all', dest='every_period', action='store_true', help='diff: compare every period with the one before it, within --year, --quarter and --through')
+    parser.add_argument('--min-change', type=float, default=default_min_change, help='diff: flag a program whose gross or net pay moved by at least this many dollars (default: %(default)s)')
+    parser.add_argument('--min-change-pct', type=float, default=default_min_change_pct, help='diff: ... and by at least this percent of what it was (default: %(default)s)')
+    parser.add_argument('--flagged-only', action='store_true', help='diff: only list the flagged program changes')
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.store):
+        print(f"Error: The store '{args.store}' was not found. Record pay periods with WageDistribution.py --store first.")
+        return 1
+    store = PayrollStore(args.store)
+
+    if args.report == 'periods':
+        print_table(store.periods(), 'RECORDED PAY PERIODS')
+        return 0
+
+    if args.report == 'diff':
+        periods = selected_periods(store, args.year, args.quarter, args.through)
+        try:
+            pairs = diff_pairs(periods, args.from_period, args.to_period, args.every_period)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return 1
+        allocations, employees = store.period_rows(sorted({period for pair in pairs for period in pair}))
+        employee_changes, program_changes = period_diff(allocations, employees, pairs, args.min_change, args.min_change_pct)
+        print_period_diff(employee_changes, program_changes, pairs, args.flagged_only)
+        return 0
+
+    year = args.year
+    if args.report == 'ytd' and year is None:
+        year = latest_year(store)
+    filters = {'year': year, 'quarter': args.quarter, 'through': args.through}
+    scope = " ".join(part for part in [str(year) if year else '', f"Q{args.quarter}" if args.quarter else '', f"through {args.through}" if args.through else ''] if part) or 'all periods'
+
+    if args.report == 'ytd':
+        table = with_total_row(store.rollup(['program'], **filters), 'program')
+        print_table(table, f"YEAR TO DATE by program ({scope})")
+    elif args.report == 'employees':
+        table = store.rollup(['employee'], **filters)
+        table = with_total_row(table, 'employee_name')
+        print_table(table, f"EMPLOYEE TOTALS ({scope})")
+    else:
+        group = ['year', 'quarter'] if args.report == 'quarters' else ['pay_date', 'period']
+        table = store.rollup(['year', 'quarter', 'program'] if args.report == 'quarters' else ['period', 'program'], **filters)
+        if len(table):
+            table = table.pivot_table(index=group, columns='program', values=args.measure, aggfunc='sum', fill_value=0, sort=False)
+        print_table(table, f"{args.measure.upper()} by {'quarter' if args.report == 'quarters' else 'pay period'} and program ({scope})", index=True)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
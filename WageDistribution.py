@@ -1,542 +1,2758 @@
-import pandas as pd
-import argparse
-import re
-
-# Create an argument parser
-parser = argparse.ArgumentParser(description='Process Excel file and save results as CSV.')
-
-# Add the input file argument
-parser.add_argument('input_file', help='Path to the input Excel file')
-
-# Parse the command-line arguments
-args = parser.parse_args()
-
-# Load the Excel file
-try:
-    excel_file = pd.read_excel(args.input_file, sheet_name='Sheet1', header=None)
-except FileNotFoundError:
-    print(f"Error: The file '{args.input_file}' was not found.")
-    exit(1)
-
-# General rule of thumb, rows will change, columns hopefully shouldn't
-
-class Employee:
-    def __init__(self, id, name, net_pay, default_department, per_program_gross_pay, gross_pay, employee_taxes, deductions, employer_taxes_minus_futa):
-        self.id = id
-        self.name = name
-        self.net_pay = net_pay
-        self.default_department = default_department
-        self.per_program_gross_pay = per_program_gross_pay
-        self.gross_pay = gross_pay
-        self.employee_taxes = employee_taxes
-        self.deductions = deductions
-        self.tax_rate = (gross_pay - net_pay - deductions) / gross_pay
-        self.employer_taxes_minus_futa = employer_taxes_minus_futa
-    
-    def toString(self):
-        # Define the string representation
-        program_gross_string = "\n\t\t".join([f"{program}: {gross}" for program, gross in self.per_program_gross_pay.items()])
-        return f"{self.name} ({self.id})\n\tDefault Department: {self.default_department}\n\tNet Pay: {self.net_pay}\n\tEmployee Taxes: {self.employee_taxes} ({round(self.tax_rate * 100, 2)}%)\n\tEmployer Taxes: {self.employer_taxes}\n\tEmployer FUTA: {self.employer_futa}\n\tDeductions: {self.deductions}\n\tGross Pay: {self.gross_pay}\n\tPrograms:\n\t\t{program_gross_string}"
-
-def extract_number_from_string(input_string):
-    # Use regular expression to extract the number
-    match = re.search(r'\d+', input_string)
-
-    if match:
-        extracted_number = match.group()
-        return extracted_number
-    else:
-        return None
-
-def find_department(row_number, department_start_lines):
-    # Sort the department_start_lines dictionary by row number
-    sorted_departments = sorted(department_start_lines.items(), key=lambda x: x[1])
-    
-    # Iterate through the sorted departments to find the correct department
-    current_department = None
-    for department, start_line in sorted_departments:
-        if row_number >= start_line:
-            current_department = department
-        else:
-            break
-    
-    return current_department
-
-def get_num(row, col):
-    if not pd.isna(excel_file.iat[row, col]):
-        return round(float(str(excel_file.iat[row, col]).replace(',', '')), 2)
-    else:
-        return None
-
-
-# column indecies
-program_col = 1             # Employee ID & program hours per employee
-grand_total_col = 2         # column where "Grand Tot:" can be found
-employee_total_col = 3      # column where "Employee Tot:" can be found
-department_title_col = 5    # title of default program
-employee_name_col = 6       # employee name
-hours_worked_col = 8        # number of hours worked for a program
-net_pay_col = 10            # direct deposit / net pay amount
-gross_pay_col = 14          # gross pay totals for this pay period
-taxes_col = 25              # taxes for this pay period
-deductions_col = 34         # deductions for this pay period
-futa_col = 38               # column where FUTA text can be found
-employer_tax_col = 43       # ER Taxes total
-
-departments_dict = {}
-# BUILD DEFAULT DEPARTMENT LOOKUP DICTIONARY
-for dept_name_row_index, dept_name_value in enumerate(excel_file.iloc[:, department_title_col]):
-    # Check if the cell value contains anything, this signals entry into a new department
-    if not pd.isna(dept_name_value):
-        # print(f"Found Dept: '{str(dept_name_value)}' at Row index: {dept_name_row_index+1}, Column F")
-        dept_name = dept_name_value
-        if 'TumbleBunnies' in dept_name_value:
-            dept_name = 'Tumblebunny'
-        departments_dict[str(dept_name)] = dept_name_row_index
-
-total_futa = 0
-employees = []
-
-for employee_name_row_index, employee_name_value in enumerate(excel_file.iloc[:, employee_name_col]):
-    # Check if the cell value contains anything, this signals entry into a new department
-    if not pd.isna(employee_name_value):
-        # print(f"\nFound Employee: '{str(employee_name_value)}' at Row {employee_name_row_index+1}, Column G")
-        # get employee name from spreadsheet
-        employee_name = employee_name_value
-        # get employee number from spreadsheet
-        employee_number = extract_number_from_string(str(excel_file.iat[employee_name_row_index, program_col]))
-        # get employee net pay / direct deposit amount
-        employee_net_pay = get_num(employee_name_row_index + 1, net_pay_col)
-
-
-        for index_j, cell_value_j in enumerate(excel_file.iloc[employee_name_row_index:, futa_col]):
-            if "FUTA" in str(cell_value_j):
-                employer_futa = get_num(employee_name_row_index+index_j, employer_tax_col)
-                break
-
-
-        # dictionary with keys being program names and values being gross pay for that program
-        employee_per_program_gross_pay = {}
-        name_row_offset = 0
-
-        # employee_name_row_index + 2 so that we start on the row of the first program with pay/hours
-        first_program_row = employee_name_row_index + 2
-        for employee_program_gross_row_index, value in enumerate(excel_file.iloc[first_program_row:, gross_pay_col]):
-            current_row = first_program_row + employee_program_gross_row_index
-
-            # add program and gross pay to the dictionary
-            employee_program_gross_pay = get_num(current_row, gross_pay_col)
-            employee_program_hours = get_num(current_row, hours_worked_col)
-            employee_program_name = None
-
-            # check if this is a program row that has payment or hours for this pay period
-            if employee_program_gross_pay is not None or employee_program_hours is not None:
-                # get program name, it may not be in line with the gross pay for the program if the number of programs is too small for a given employee
-                # if it is empty, add a local offset and try again.
-                
-                # loop a limited number of times looking for the matching program name
-                for i in range(101):
-                    # if is empty
-                    test_cell = excel_file.iat[current_row + name_row_offset, program_col]
-                    if pd.isna(test_cell): # if the test cell is empty, add to the offset and test again
-                        name_row_offset = name_row_offset + 1
-                    else:
-                        # we found the program name!
-                        employee_program_name = str(test_cell)
-                        if "Polka Dots" in employee_program_name:
-                            employee_program_name = "Polkadots"
-                        break
-                    
-                    if i > 99:
-                        print(f"ERROR: Unable to find program for listed gross pay for {employee_name}: ${employee_program_gross_pay}")
-                        break
-
-            if employee_program_hours is None:
-                # If we have pay but no hours, it was a bonus of some kind.
-                if employee_program_gross_pay is not None:
-                    employee_per_program_gross_pay[employee_program_name] = employee_program_gross_pay
-            else:
-                # But if we have hours
-                if employee_program_gross_pay is None:
-                    # AND our pay is empty, that means we don't have a pay rate for the hours reported and our employee did not get money they earned.
-                    print(f"\n!!! ERROR! {employee_name} has {employee_program_hours} hours reported for {employee_program_name} but earned $0. Check their pay rate for that category.")
-                else:
-                    # All is good, we have hours, we have pay. Things are great
-                    employee_per_program_gross_pay[employee_program_name] = employee_program_gross_pay
-
-            # +1 to the starting row because we know the totals are the row after the last program
-            employee_total_cell = excel_file.iat[current_row + 1, employee_total_col]
-            if "Employee Tot:" in str(employee_total_cell):
-                # grab the gross_pay, taxes, and deductions
-                employee_gross_pay = get_num(current_row + 1, gross_pay_col)
-                if employee_gross_pay > 0:
-                    employee_taxes = get_num(current_row + 1, taxes_col)
-                    employee_deductions = get_num(current_row + 1, deductions_col)
-                    employer_taxes_minus_futa = get_num(current_row + 1, employer_tax_col)
-                            
-                    # print(f"\tEmployer Taxes for {employee_name}: {employer_taxes_minus_futa} - {employer_futa} = {employer_taxes_minus_futa - employer_futa}")
-                    # futa is billed to us separately so don't include it in the breakdown for the tax withdrawal
-                    
-                    total_futa += employer_futa
-                    # print(f"total_futa: {total_futa}")
-                    employer_taxes_minus_futa -= employer_futa
-
-                    # finishing with this employee, grab the stated totals and move to next employee
-                    employee = Employee(employee_number, employee_name, employee_net_pay, find_department(current_row, departments_dict), employee_per_program_gross_pay, employee_gross_pay, employee_taxes, employee_deductions, employer_taxes_minus_futa)
-                    # print(f"{employee.toString()}")
-                    employees.append(employee)
-                else:
-                    print(f"\nWarning: {employee_name} had no earnings this pay period.")
-                break
-
-stated_gross = None
-stated_taxes = None
-stated_deductions = None
-stated_employer_taxes_minus_futa = None
-stated_employer_futa = None
-stated_net = None
-stated_ca_ett = None
-
-grand_total_data_frame = None
-
-# Iterate through the cells in Column C
-for index, cell_value in enumerate(excel_file.iloc[:, grand_total_col]):
-    # Check if the cell value contains "Grand Tot:"
-    if "Grand Tot:" in str(cell_value): 
-        stated_gross = get_num(index, gross_pay_col)
-        stated_taxes = get_num(index, taxes_col)
-        stated_deductions = get_num(index, deductions_col)
-        stated_net = get_num(index + 2, gross_pay_col + 3)
-
-        for index_j, cell_value_j in enumerate(excel_file.iloc[index:, futa_col]):
-            if "FUTA" in str(cell_value_j):
-                stated_employer_futa = get_num(index+index_j, employer_tax_col)
-            if "CA ETT" in str(cell_value_j):
-                stated_ca_ett = get_num(index+index_j, employer_tax_col)
-                break
-            
-        # we subtract out FUTA here because it 
-        stated_employer_taxes_minus_futa = get_num(index, employer_tax_col) - stated_employer_futa
-        break
-
-
-
-
-
-
-
-
-
-
-
-
-tracked_programs = ['Admin', 'Dance', 'Events', 'Gymnastics', 'Hospitality', 'Polkadots', 'Swim', 'TAG', 'Team', 'Tumblebunny', 'Maintenance']
-
-tax_by_program = {}
-net_by_program = {}
-gross_by_program = {}
-employer_taxes_by_program = {}
-
-for tracked_program in tracked_programs:
-    tax_by_program[tracked_program] = 0
-    net_by_program[tracked_program] = 0
-    gross_by_program[tracked_program] = 0
-    employer_taxes_by_program[tracked_program] = 0
-
-# should store deductions per category as well, so we know how to refund the expenses
-deducted_by_program = {}
-
-# used to verify all money is accounted for and there are no rounding errors.
-calculated_gross_total = 0
-calculated_deductions = 0
-for employee in employees:
-    # print(employee.toString())
-    calculated_gross_total += employee.gross_pay
-    
-    # but for now, just get the total deduction per employee
-    calculated_deductions += employee.deductions
-    employee.deductions_remaining = employee.deductions
-
-    # Edge case here where there is more deductions than earnings. Flag it so we can handle it if it pops up
-    if round(employee.deductions, 2) > round(employee.gross_pay - employee.employee_taxes, 2):
-        print(f"ERROR: {employee.name} has more deductions ({employee.deductions}) than available net pay ({employee.gross_pay - employee.employee_taxes}). This is very weird and will need special handling.")
-
-
-    # will contain the consolidated list of programs instead of ALL pay categories
-    employee_mapped_program_gross = {}
-
-    # There are a select few people that need to be exclude or split between programs
-    # Nasa Nergui       660735 | Manage = Split evenly
-    # Linsay Groom      91844 | Manage = Split evenly
-    # Ashley Lewis      95380 | Manage = Split evenly
-    # Scott Wilkie      685470 | Manage = Split evenly
-    # Khulan Purevjav   693133 | Clean = Split half into each program
-    special_case_employees = [660735, 693133, 91844, 95380, 685470]
-    
-    # Manage hours for special case employees will be split between main programs
-    split_programs = ['Events', 'Gymnastics', 'Hospitality', 'Tumblebunny', 'Dance', 'Swim', 'TAG']
-    split_amount = 0
-
-    if employee.id == 660735: # NASANJARGAL NERGUI
-        split_amount = (employee.per_program_gross_pay["Manage"] * (2 / 3)) / len(split_programs) # 2/3 of managing goes to all programs
-        employee.per_program_gross_pay["TAG"] += employee.per_program_gross_pay["Manage"] / 3 # 1/3 of managing goes specifically to TAG (which also has some from the split)
-        del employee.per_program_gross_pay["Manage"]
-
-    elif employee.id == 693133: # KHULAN PUREVJAV
-        # Move "Clean" hours to "Maintenance"
-        employee.default_department = "Maintenance"
-
-    elif employee.id == 91844: # LINDSAY A GROOM
-        # Should have specific hours for TEAM and COMP, those are handled as normal
-        split_amount = employee.per_program_gross_pay["Manage"] / len(split_programs)
-        del employee.per_program_gross_pay["Manage"]
-
-    elif employee.id == 95380: # ASHLEY M LEWIS
-        # Should have specific hours for TEAM and COMP, those are handled as normal
-        split_amount = employee.per_program_gross_pay["Manage"] / len(split_programs)
-        del employee.per_program_gross_pay["Manage"]
-
-    elif employee.id == 685470: # SCOTT A WILKIE
-        # Move "Manage" hours to "Maintenance"
-        employee.default_department = "Maintenance"
-        
-    #current problem is that program gross pay is reassigned correctly, but taxes are just shifted to the person's default program
-    
-    for split_program in split_programs:
-        if split_program in employee_mapped_program_gross:
-            employee_mapped_program_gross[split_program] += split_amount
-        else:
-            employee_mapped_program_gross[split_program] = split_amount
-
-    # Loop over all employee programs that the employee had pay in
-    for employee_program, employee_program_gross in employee.per_program_gross_pay.items():
-        adjusted_program = employee_program
-
-        if employee.id not in special_case_employees: # Everyone else
-            if employee_program in tracked_programs:
-                adjusted_program = employee_program
-            else:
-                # Many categories like "Mentor" need to be adjusted into their default program
-                map_to_default = ["Manage", "Mentor", "Full Class", "Training", "Overtime", "Private Lessons", "Senior Coach", "Sick", "Split Shift Premium", "Trainer", "Bonus", "Gift Cards or $$"]
-                if employee_program in map_to_default:
-                    adjusted_program = employee.default_department
-                elif ('Camps' in employee_program or 'Kids Night Out' in employee_program):
-                    adjusted_program = 'Events'
-                elif 'Clean' in employee_program:
-                    adjusted_program = 'Maintenance'
-                elif 'Team Coach Fee' in employee_program:
-                    adjusted_program = 'Team'
-                else:
-                    print(f"Unhandled program! {employee.name}: {employee_program}")
-
-        # GROSS pay
-        if adjusted_program in employee_mapped_program_gross:
-            employee_mapped_program_gross[adjusted_program] += employee_program_gross
-        else:
-            employee_mapped_program_gross[adjusted_program] = employee_program_gross
-
-    # we sort this one so that the programs are set up with values smallest to largets. This makes handling deductions easier.
-    employee_mapped_program_gross = dict(sorted(employee_mapped_program_gross.items(), key=lambda item: item[1]))
-
-    deduction_amount_already_applied = 0
-    programs_processed = 0
-    
-    # loop over adjusted program gross totals and calculate taxes and apply deductions
-    for adjusted_program, employee_program_gross in employee_mapped_program_gross.items(): 
-        if adjusted_program in gross_by_program:
-            gross_by_program[adjusted_program] += employee_program_gross
-        else:
-            gross_by_program[adjusted_program] = employee_program_gross
-
-        # Split tax for each program. Tax rate is per employee, not per program, so this is ok
-        # print(f"{employee.name}: {adjusted_program}: {employee_program_gross} | {employee.tax_rate}")
-        employee_program_tax = employee_program_gross * employee.tax_rate
-        
-        if adjusted_program in tax_by_program:
-            tax_by_program[adjusted_program] += employee_program_tax 
-        else:
-            tax_by_program[adjusted_program] = employee_program_tax
-
-        # In order to properly classify employer taxes into their correct program, we need to know how much of the income came from a certain program
-        # Calculate employer taxes by program
-        program_ratio = employee_program_gross / employee.gross_pay        
-        employer_program_tax = employee.employer_taxes_minus_futa * program_ratio
-        if adjusted_program in employer_taxes_by_program:
-            employer_taxes_by_program[adjusted_program] += employer_program_tax 
-        else:
-            employer_taxes_by_program[adjusted_program] = employer_program_tax
-
-
-
-
-
-        # find the amount to take from each program to evenly distribute deductions across programs
-        # TODO: if I ever map certain deductions to certain programs, this will need to change
-        deductions_split_among_programs = (employee.deductions - deduction_amount_already_applied) / (len(employee_mapped_program_gross) - programs_processed)
-
-        # calculate net pay BEFORE applying deductions
-        net_pay_before_deductions = employee_program_gross - employee_program_tax
-
-        if deductions_split_among_programs <= net_pay_before_deductions:
-            employee_program_net = net_pay_before_deductions - deductions_split_among_programs
-
-            deduction_amount_already_applied += deductions_split_among_programs
-            programs_processed += 1
-        else:
-            employee_program_net = 0
-            # print(f"I KNEW THIS CODE WAS WORTH WRITING! Totally a case where split deduction amount was greater than what was earned in a category. {employee.name}: {adjusted_program}")
-            deduction_amount_already_applied += net_pay_before_deductions
-            programs_processed += 1
-
-
-
-        if programs_processed == len(employee_mapped_program_gross) and deduction_amount_already_applied < employee.deductions:
-            print(f"ERROR: Unable to apply all deductions because the last category ({adjusted_program}) didn't have enough money in it to cover the distribution.")
-            print(f"\tBecause we sort the dict by program gross earnings, this case should now only occur when deductions are more than net earnings.")
-            print(f"\tAmount in last program {adjusted_program}: {employee_program_gross} | still left to deduct: {deductions_split_among_programs}")
-
-
-
-        if adjusted_program in net_by_program:
-            net_by_program[adjusted_program] += employee_program_net
-        else:
-            net_by_program[adjusted_program] = employee_program_net
-
-
-
-# print(f"\n\nGROSS: Every pay category with non-zero pay:\n")
-# for program, gross in gross_by_program.items():
-#     print(f"\t{program}: {round(gross, 2)}")
-
-
-print(f"\n\nNote: There are 2 withdrawals for taxes, a large one and a small one.\nThe small one is the total FUTA (${round(total_futa,2)}) taxes (Federal unemployment tax).\nThe larger one consists of: (employee_taxes + employer_taxes - FUTA + CA_ETT)\nHowever, since we take out the FUTA charge per employee, we don't do it here.")
-
-print(f"\nTAX: Every pay category with non-zero pay:\n")
-print(f"\tAdmin: \t\t{stated_ca_ett} (CA ETT)")
-
-calculated_employer_taxes_minus_futa = 0
-calculated_employee_taxes = 0
-tax_per_program_sum = 0
-for program, tax in tax_by_program.items():
-    combined_taxes = tax + employer_taxes_by_program[program]
-    if combined_taxes > 0:
-        calculated_employee_taxes += tax
-        calculated_employer_taxes_minus_futa += employer_taxes_by_program[program]
-        spaces = "\t" if len(program) >= 6 else "\t\t"
-        print(f"\t{program}: {spaces}{round(tax, 2)}   \t+ {round(employer_taxes_by_program[program], 2)}   \t= {round(combined_taxes, 2)}")
-
-        tax_per_program_sum += combined_taxes
-
-
-print(f"\n\n\tCalculated Total Taxes: \t\t{round(tax_per_program_sum + stated_ca_ett, 2)}")
-print(f"\tIt should equal (stated values): \t{stated_taxes + stated_employer_taxes_minus_futa + stated_ca_ett}\n")
-
-print(f"\tCalculated Employee Taxes: \t\t{round(calculated_employee_taxes, 2)}\t(All employee taxes added together)")
-print(f"\tStated Employee Taxes: \t\t\t{round(stated_taxes, 2)}\n")
-
-print(f"\tCalculated Employer Taxes: \t\t{round(calculated_employer_taxes_minus_futa, 2)}\t(All employer taxes per employee minus FUTA added together)")
-print(f"\tStated Employer Taxes: \t\t\t{round(stated_employer_taxes_minus_futa, 2)}\n")
-
-print(f"\tCalculated Employer FUTA: \t\t{round(total_futa, 2)} \t(All employee FUTA values added together)")
-print(f"\tStated Employer FUTA: \t\t\t{round(stated_employer_futa, 2)}\n")
-
-
-print(f"\n\temployee_taxes + employer_taxes + CA_ETT = Amount Taken From Bank Account")
-print(f"\t{calculated_employee_taxes} + {calculated_employer_taxes_minus_futa} + {stated_ca_ett} = {calculated_employee_taxes + calculated_employer_taxes_minus_futa + stated_ca_ett}")
-
-# print(f"\nEMPLOYER TAX:\n")
-# # this one we can calculate on the fly using already gathered data and percentages
-# for program, tax in tax_by_program.items():
-#     proportial_taxes = (tax / calculated_employee_taxes) * employer_taxes
-#     print(f"\t{program}: {round(proportial_taxes, 2)}")
-#     calculated_employer_taxes_minus_futa += proportial_taxes
-#     employer_taxes_by_program[program] = proportial_taxes
-
-
-total_direct_deposited = 0
-print(f"\nNET: Every pay category with non-zero pay:\n")
-for program, net in net_by_program.items():
-    if net > 0:
-        print(f"\t{program}: {round(net, 2)}")
-        total_direct_deposited += net
-
-
-
-print(f"\n\tCALCULATED NET: \t\t{round(total_direct_deposited, 2)}")
-print(f"\tSTATED NET: \t\t\t{round(stated_net, 2)}")
-
-print(f"\n\tCALCULATED DEDUCTIONS: \t\t{calculated_deductions}")
-print(f"\tSTATED DEDUCTIONS: \t\t{round(stated_deductions, 2)}\n")
-
-print(f"\tCOMBINED CALCULATED: \t\t{round(calculated_deductions + calculated_employee_taxes + total_direct_deposited, 2)}\n")
-
-print(f"\tCALCULATED GROSS: \t\t{round(calculated_gross_total, 2)}")
-print(f"\tSTATED GROSS: \t\t\t{round(stated_gross, 2)}\n")
-
-
-
-
-
-
-
-# # calculated_hourly_gross = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-# # calculated_tax_rate = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-# # calculated_hourly_net = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-# # calculated_hourly_taxed = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-
-# per_employee_hourly_gross = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-# per_employee_tax_rate = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-# per_employee_hourly_net = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-# per_employee_hourly_taxed = [-1, -1, -1, -1, -1, -1, -1, -1, -1, -1]
-
-# data_dictionary = {
-#   'Programs': ['Events', 'Gymnastics', 'Hospitality', 'Tumblebunny', 'Dance', 'Swim', 'TAG', 'Polkadots', 'Sick', 'Clean'],
-
-#   # Looking at the provided "Department" totals, so not breaking things up per hour, just based on an employee's default department
-#   # 'Dept Gross Pay': dept_gross,
-#   # 'Dept Net Pay': dept_net,
-#   # 'Dept Taxes Pay': dept_taxed,
-
-#   # Using the hours submitted for each program on Page 16. Should be more accurate, especially for wages, but it normalizes taxes
-#   'Calculated Hourly Gross Pay': calculated_hourly_gross,
-#   'Calculated Effective Tax Rate': calculated_tax_rate,
-#   'Calculated Hourly Net Pay': calculated_hourly_net,
-#   'Calculated Hourly Taxed Pay': calculated_hourly_taxed,
-
-#   # Calculate a tax rate per employee using their own hours and taxed amount
-#   'Per Employee Hourly Gross Pay': per_employee_hourly_gross,
-#   'Per Employee Effective Tax Rate': per_employee_tax_rate,
-#   'Per Employee Hourly Net Pay': per_employee_hourly_net,
-#   'Per Employee Hourly Taxed Amount': per_employee_hourly_taxed
-# }
-
-# result_df = pd.DataFrame(data_dictionary)
-
-
-
-# empty_row = pd.DataFrame({" ":[" "]})
-
-# combined_df = pd.DataFrame()
-# if grand_total_data_frame is not None:
-#     combined_df = pd.concat([combined_df, grand_total_data_frame], ignore_index=True)
-#     combined_df = pd.concat([combined_df, empty_row], ignore_index=True)
-
-
-# if departments_data_frame is not None:
-#     combined_df = pd.concat([combined_df, departments_data_frame], ignore_index=True)
-#     combined_df = pd.concat([combined_df, empty_row], ignore_index=True)
-
-# if result_df is not None:
-#     combined_df = pd.concat([combined_df, result_df], ignore_index=True)
-#     combined_df = pd.concat([combined_df, empty_row], ignore_index=True)
-
-# # Generate the output file name based on the input file name
-# output_file = args.input_file.replace('.xls', '_output.csv')
-
-# # Save the result DataFrame to CSV
-# if combined_df is not None:
-#     combined_df.to_csv(output_file, index=False)
-# else:
-#     result_df.to_csv(output_file, index=False)
-
-# print(f"Results saved to {output_file}")
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import time
+import zipfile
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from fractions import Fraction
+from itertools import islice
+
+# pandas and numpy are imported where they are used, so that importing this file, --help and --validate stay fast
+
+# General rule of thumb, rows will change, columns hopefully shouldn't
+
+# EMPLOYEES
+# money columns of an EmployeeTable, in the order they are stored
+employee_money_columns = ['net_pay', 'gross_pay', 'employee_taxes', 'deductions', 'employer_taxes_minus_futa', 'employer_futa']
+# what each of them is read from, for error messages
+employee_money_labels = ['net pay', 'gross pay', 'taxes', 'deductions', 'employer taxes', 'FUTA']
+
+
+class EmployeeTable:
+    # Every employee of a register in columns, so a register (or years of them) costs a few arrays instead of an object per employee.
+    # Money is int64 cents, one column per field. Pay per category is a sparse employee x category matrix in CSR form:
+    # a row's entries are program_offsets[row]:program_offsets[row + 1] of category_codes (into categories) and category_cents,
+    # in the order the register lists them. Indexing or iterating the table gives Employee row views.
+    def __init__(self, ids, names, default_departments, money, categories, program_offsets, category_codes, category_cents):
+        self.ids = ids
+        self.names = names
+        self.default_departments = default_departments
+        self.money = money
+        self.net_pay = money[:, 0]
+        self.gross_pay = money[:, 1]
+        self.employee_taxes = money[:, 2]
+        self.deductions = money[:, 3]
+        self.employer_taxes_minus_futa = money[:, 4]
+        self.employer_futa = money[:, 5]
+        self.categories = categories
+        self.program_offsets = program_offsets
+        self.category_codes = category_codes
+        self.category_cents = category_cents
+
+    @classmethod
+    def from_blocks(cls, employee_blocks, default_departments):
+        import numpy as np
+
+        categories = {}
+        program_offsets = [0]
+        category_codes = []
+        category_gross = []
+        for block in employee_blocks:
+            for category, gross in block.per_program_gross_pay.items():
+                category_codes.append(categories.setdefault(category, len(categories)))
+                category_gross.append(gross)
+            program_offsets.append(len(category_codes))
+
+        # a blank cell comes back from get_num as None, which would be NaN here, so it is refused instead of read as some amount
+        dollars = np.array([[block.net_pay, block.total.gross_pay, block.total.taxes, block.total.deductions, block.total.employer_taxes, block.employer_futa]
+                            for block in employee_blocks], dtype=np.float64).reshape(-1, len(employee_money_columns))
+        missing = ~np.isfinite(dollars)
+        if missing.any():
+            row = int(np.flatnonzero(missing.any(axis=1))[0])
+            block = employee_blocks[row]
+            labels = [label for label, is_missing in zip(employee_money_labels, missing[row]) if is_missing]
+            raise ValueError(f"{block.name} ({block.number}) has no {', '.join(labels)} amount in the register, fill in the blank cell{'s' if len(labels) > 1 else ''} and run it again.")
+        money = to_cents(dollars)
+        # futa is billed to us separately so don't include it in the breakdown for the tax withdrawal
+        money[:, 4] -= money[:, 5]
+        return cls([block.number for block in employee_blocks], [block.name for block in employee_blocks], list(default_departments), money, list(categories),
+                   np.array(program_offsets, dtype=np.int64), np.array(category_codes, dtype=np.int32), to_cents(category_gross))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return Employee(self, row % len(self))
+
+    def __iter__(self):
+        return (Employee(self, row) for row in range(len(self)))
+
+    def program_cents(self, row):
+        # {category: cents} for one employee
+        start, end = self.program_offsets[row], self.program_offsets[row + 1]
+        return {self.categories[code]: cents for code, cents in zip(self.category_codes[start:end].tolist(), self.category_cents[start:end].tolist())}
+
+    def iter_program_cents(self):
+        # {category: cents} for every employee in order, reading the matrix once
+        offsets = self.program_offsets.tolist()
+        categories = [self.categories[code] for code in self.category_codes.tolist()]
+        cents = self.category_cents.tolist()
+        for row in range(len(self)):
+            yield dict(zip(categories[offsets[row]:offsets[row + 1]], cents[offsets[row]:offsets[row + 1]]))
+
+
+def dollars_column(column):
+    # read only property of an Employee view, one EmployeeTable money column in dollars
+    return property(lambda employee: int(getattr(employee.table, column)[employee.row]) / 100)
+
+
+class Employee:
+    # One row of an EmployeeTable, for code that wants one employee at a time. Nothing is copied, every read goes to the table.
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    id = property(lambda employee: employee.table.ids[employee.row])
+    name = property(lambda employee: employee.table.names[employee.row])
+    default_department = property(lambda employee: employee.table.default_departments[employee.row])
+    net_pay = dollars_column('net_pay')
+    gross_pay = dollars_column('gross_pay')
+    employee_taxes = dollars_column('employee_taxes')
+    deductions = dollars_column('deductions')
+    employer_taxes_minus_futa = dollars_column('employer_taxes_minus_futa')
+    employer_futa = dollars_column('employer_futa')
+
+    @property
+    def per_program_gross_pay(self):
+        # {category: dollars}, a new dict on every read
+        return {category: cents / 100 for category, cents in self.table.program_cents(self.row).items()}
+
+    @property
+    def tax_rate(self):
+        return (self.gross_pay - self.net_pay - self.deductions) / self.gross_pay
+
+    def toString(self):
+        # Define the string representation
+        program_gross_string = "\n\t\t".join([f"{program}: {gross}" for program, gross in self.per_program_gross_pay.items()])
+        return f"{self.name} ({self.id})\n\tDefault Department: {self.default_department}\n\tNet Pay: {self.net_pay}\n\tEmployee Taxes: {self.employee_taxes} ({round(self.tax_rate * 100, 2)}%)\n\tEmployer Taxes: {self.employer_taxes_minus_futa}\n\tEmployer FUTA: {self.employer_futa}\n\tDeductions: {self.deductions}\n\tGross Pay: {self.gross_pay}\n\tPrograms:\n\t\t{program_gross_string}"
+
+def extract_number_from_string(input_string):
+    # Use regular expression to extract the number
+    match = re.search(r'\d+', input_string)
+
+    if match:
+        extracted_number = match.group()
+        return extracted_number
+    else:
+        return None
+
+class DepartmentIndex:
+    # Department start rows compiled once into sorted arrays. A row belongs to the last department that starts at or before it.
+    def __init__(self, department_start_lines):
+        import numpy as np
+
+        sorted_departments = sorted(department_start_lines.items(), key=lambda x: x[1])
+        self.names = np.array([department for department, start_line in sorted_departments] + [None], dtype=object)
+        self.start_lines = np.array([start_line for department, start_line in sorted_departments], dtype=np.int64)
+        self.start_lines_list = self.start_lines.tolist()
+
+    def find(self, row_number):
+        # index -1 picks the None at the end of names, for rows above the first department
+        return self.names[bisect_right(self.start_lines_list, row_number) - 1]
+
+    def find_all(self, row_numbers):
+        import numpy as np
+
+        return self.names[np.searchsorted(self.start_lines, np.asarray(row_numbers, dtype=np.int64), side='right') - 1]
+
+# column indecies
+program_col = 1             # Employee ID & program hours per employee
+grand_total_col = 2         # column where "Grand Tot:" can be found
+employee_total_col = 3      # column where "Employee Tot:" can be found
+department_title_col = 5    # title of default program
+employee_name_col = 6       # employee name
+hours_worked_col = 8        # number of hours worked for a program
+net_pay_col = 10            # direct deposit / net pay amount
+gross_pay_col = 14          # gross pay totals for this pay period
+grand_total_net_col = 17    # stated net pay, two rows below "Grand Tot:"
+taxes_col = 25              # taxes for this pay period
+deductions_col = 34         # deductions for this pay period
+futa_col = 38               # column where FUTA text can be found
+employer_tax_col = 43       # ER Taxes total
+
+# every column we read numbers from
+numeric_cols = [hours_worked_col, net_pay_col, gross_pay_col, grand_total_net_col, taxes_col, deductions_col, employer_tax_col]
+# every column we read text from
+text_cols = [program_col, grand_total_col, employee_total_col, department_title_col, employee_name_col, futa_col]
+# the only columns we load, the rest of the export is never looked at
+register_cols = sorted(set(numeric_cols + text_cols))
+
+
+def pick_engine(path, engine='auto'):
+    if engine != 'auto':
+        return engine
+    if importlib.util.find_spec('python_calamine') is not None:
+        return 'calamine'
+    if os.path.splitext(path)[1].lower() in ('.xlsx', '.xlsm') and importlib.util.find_spec('openpyxl') is not None:
+        return 'openpyxl'
+    return 'pandas'
+
+
+def read_register_openpyxl(path, sheet_name, cols=None, max_row=None):
+    # Stream the rows with openpyxl's read-only iterator and keep only the columns we use (every column when cols is None).
+    import numpy as np
+    import openpyxl
+    import pandas as pd
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name]
+        # the stored sheet dimensions can't be trusted, same as pandas does
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True, max_row=max_row)
+        if cols is None:
+            rows = list(rows)
+            cols = list(range(max((len(row) for row in rows), default=0)))
+        data = {col: [] for col in cols}
+        for row in rows:
+            row_length = len(row)
+            for col in cols:
+                data[col].append(row[col] if col < row_length else None)
+    finally:
+        workbook.close()
+
+    excel_file = pd.DataFrame(data, columns=cols, dtype=object)
+    # pandas drops the empty rows at the bottom of a sheet, so do we
+    filled_rows = np.flatnonzero(excel_file.notna().any(axis=1).to_numpy())
+    return excel_file.iloc[:filled_rows[-1] + 1 if len(filled_rows) else 0]
+
+
+def read_register_columns(path, sheet_name, engine, cols=None, max_row=None):
+    # The given columns (every column when None) of the first max_row rows (every row when None), labeled by their position
+    import pandas as pd
+
+    if engine == 'openpyxl':
+        return read_register_openpyxl(path, sheet_name, cols, max_row)
+    return pd.read_excel(path, sheet_name=sheet_name, header=None, usecols=cols, nrows=max_row, engine='calamine' if engine == 'calamine' else None)
+
+
+def load_register(path, sheet_name='Sheet1', engine='auto', cols=register_cols, layouts=None):
+    # Load only the columns the parser reads. Returns the sheet and the engine that was used.
+    # With a LayoutCache the columns are found in the register first, see LAYOUT DETECTION. The sheet comes back with them
+    # where the constants above say they are either way, and a note about the layout in excel_file.attrs['layout_note'] when there is one.
+    engine = pick_engine(path, engine)
+    if layouts is None:
+        excel_file = read_register_columns(path, sheet_name, engine, cols)
+    else:
+        excel_file = load_detected_layout(path, sheet_name, engine, cols, layouts)
+    if engine == 'openpyxl':
+        # whole numbers come back from openpyxl as floats, pandas turns them into ints
+        for col in text_cols:
+            if col in excel_file:
+                excel_file[col] = excel_file[col].map(lambda value: int(value) if isinstance(value, float) and value.is_integer() else value)
+    return excel_file, engine
+
+
+# LAYOUT DETECTION
+# The column constants above are where the export we know puts things. With --layout auto the columns of every register
+# are found from the top of it instead, so a vendor moving a column is picked up instead of read wrong: the first
+# employee, its "Employee Tot:" row and its "FUTA" row are all within the first layout_scan_rows rows. "Grand Tot:" is
+# only at the bottom, so its columns are taken to have moved with their neighbours and checked once the register is loaded.
+# A detected layout is cached under a fingerprint of the rows above the first employee, so later registers with the same
+# fingerprint skip detecting. Either way the register itself is only read for the columns the parser uses.
+RegisterLayout = namedtuple('RegisterLayout', ['program', 'grand_total', 'employee_total', 'department_title', 'employee_name', 'hours_worked', 'net_pay', 'gross_pay',
+                                               'grand_total_net', 'taxes', 'deductions', 'futa', 'employer_tax'])
+default_layout = RegisterLayout(program_col, grand_total_col, employee_total_col, department_title_col, employee_name_col, hours_worked_col, net_pay_col, gross_pay_col,
+                                grand_total_net_col, taxes_col, deductions_col, futa_col, employer_tax_col)
+
+# the rows read to detect a layout, the first employee has to start and end within them
+layout_scan_rows = 200
+# layouts kept per fingerprint, a header can be shared by exports that put the columns in different places
+layouts_per_fingerprint = 4
+# the fields only found on the "Grand Tot:" rows at the bottom of a register
+grand_total_fields = ['grand_total', 'grand_total_net']
+layout_cache_name = 'layouts.json'
+
+
+def sheet_cells(sheet):
+    # every cell of a sheet as text ('' when empty) and whether it holds a number, as two 2D arrays
+    import numpy as np
+    import pandas as pd
+
+    values = sheet.to_numpy(dtype=object)
+    text = np.where(pd.isna(values), '', values.astype(str))
+    numbers = pd.to_numeric(np.char.replace(text.ravel(), ',', ''), errors='coerce').reshape(text.shape)
+    return text, ~np.isnan(numbers)
+
+
+def find_marker(text, marker, start_row=0):
+    # (row, col) of the first cell at or below start_row containing marker, None if there isn't one
+    import numpy as np
+
+    rows, cols = np.nonzero(np.char.find(text[start_row:], marker) >= 0)
+    return (int(rows[0]) + start_row, int(cols[0])) if len(rows) else None
+
+
+def first_employee_row(text, is_number):
+    # The row the first employee starts on, None without an "Employee Tot:" row to end it.
+    # Like the parser, an employee is a value in the employee name column, with its net pay on the next row. When the
+    # name column has moved it is the last row filled before the first row with a number in it, the rows above being
+    # the header and the department title.
+    import numpy as np
+
+    total = find_marker(text, "Employee Tot:")
+    if total is None:
+        return None
+    # the parser looks for the totals from the third row below the name
+    last_row = total[0] - 3
+    if last_row < 0:
+        return None
+    if employee_name_col < text.shape[1]:
+        rows = np.flatnonzero((text[:last_row + 1, employee_name_col] != '') & is_number[1:last_row + 2].any(axis=1))
+        if len(rows):
+            return int(rows[0])
+    number_rows = np.flatnonzero(is_number[:total[0]].any(axis=1))
+    filled_rows = np.flatnonzero((text[:number_rows[0]] != '').any(axis=1)) if len(number_rows) else []
+    return int(filled_rows[-1]) if len(filled_rows) and filled_rows[-1] <= last_row else None
+
+
+def header_fingerprint(text, employee_row):
+    # Hash of the header rows (everything above the first employee but the department title) with digits blanked out, so
+    # dates don't matter, and of which cells the first employee row fills.
+    import numpy as np
+
+    header_rows = [row for row in range(employee_row) if (text[row] != '').any()][:-1]
+    header = [[row, col, re.sub(r'\d', '#', text[row, col])] for row in header_rows for col in np.flatnonzero(text[row] != '').tolist()]
+    header.append(np.flatnonzero(text[employee_row] != '').tolist())
+    return hashlib.sha256(json.dumps(header).encode()).hexdigest()
+
+
+def detect_layout(text, is_number, employee_row):
+    # Find every column from the first employee's rows and its "Employee Tot:" and "FUTA" rows, in the cells of the top of
+    # a sheet (see sheet_cells). The "Grand Tot:" columns are moved along with the columns next to them.
+    # Raises ValueError naming what couldn't be found.
+    import numpy as np
+
+    if employee_row is None:
+        raise ValueError('no employee followed by an "Employee Tot:" row')
+    markers = {}
+    for marker in ["Employee Tot:", "FUTA"]:
+        markers[marker] = find_marker(text, marker, employee_row)
+        if markers[marker] is None:
+            raise ValueError(f'no "{marker}" cell below the first employee')
+    total_row, employee_total = markers["Employee Tot:"]
+    futa_row, futa = markers["FUTA"]
+
+    def first_number(row, start_col, end_col):
+        cols = np.flatnonzero(is_number[row, start_col:end_col]) if 0 <= row < len(text) else []
+        return int(cols[0]) + start_col if len(cols) else None
+
+    # the employee number is the first thing on the employee's row and the name the next, the department title is the
+    # first thing on the row above the employee
+    employee_cols = np.flatnonzero(text[employee_row] != '')
+    program = int(employee_cols[0])
+    employee_name = int(employee_cols[1]) if len(employee_cols) > 1 else None
+    title_rows = np.flatnonzero((text[:employee_row] != '').any(axis=1))
+    department_title = int(np.flatnonzero(text[title_rows[-1]] != '')[0]) if len(title_rows) else None
+    employer_tax = first_number(futa_row, futa + 1, text.shape[1])
+    net_pay = first_number(employee_row + 1, 0, futa)
+
+    # gross pay, taxes and deductions are the last three numbers before the employer taxes on an "Employee Tot:" row,
+    # from the first one that has all three (employees without earnings only have gross pay)
+    gross_pay = taxes = deductions = None
+    total_rows = np.flatnonzero(np.char.find(text[:, employee_total], "Employee Tot:") >= 0)
+    for row in total_rows.tolist():
+        cols = np.flatnonzero(is_number[row, employee_total + 1:futa]) + employee_total + 1
+        if len(cols) >= 3:
+            gross_pay, taxes, deductions = cols[-3:].tolist()
+            break
+
+    # hours are in the column left of gross pay that is filled on the most program lines
+    hours_worked = None
+    if gross_pay is not None:
+        program_lines = is_number[:, gross_pay].copy()
+        program_lines[total_rows] = False
+        line_numbers = is_number[program_lines, :gross_pay].sum(axis=0)
+        if net_pay is not None and net_pay < gross_pay:
+            line_numbers[net_pay] = 0
+        if len(line_numbers) and line_numbers.max() > 0:
+            hours_worked = int(line_numbers.argmax())
+
+    # "Grand Tot:" sits next to "Employee Tot:" and its net pay between gross pay and taxes
+    grand_total = employee_total + grand_total_col - employee_total_col
+    grand_total_net = gross_pay + grand_total_net_col - gross_pay_col if gross_pay is not None else None
+
+    layout = RegisterLayout(program, grand_total, employee_total, department_title, employee_name, hours_worked, net_pay, gross_pay, grand_total_net, taxes, deductions, futa, employer_tax)
+    missing = [field for field, col in zip(layout._fields, layout) if col is None or col < 0]
+    if missing:
+        raise ValueError(f"could not find the {', '.join(missing)} column{'s' if len(missing) > 1 else ''}")
+    return layout
+
+
+def detect_grand_total_layout(sheet, layout):
+    # layout with its "Grand Tot:" columns found in the whole sheet, for when they didn't move along with the rest.
+    # Raises ValueError when there is no "Grand Tot:" row.
+    import numpy as np
+
+    text, is_number = sheet_cells(sheet)
+    grand_total = find_marker(text, "Grand Tot:")
+    if grand_total is None:
+        raise ValueError('no "Grand Tot:" cell')
+    net_cols = np.flatnonzero(is_number[grand_total[0] + 2, :layout.futa]) if grand_total[0] + 2 < len(text) else []
+    if not len(net_cols):
+        raise ValueError("could not find the grand_total_net column")
+    return layout._replace(grand_total=grand_total[1], grand_total_net=int(net_cols[0]))
+
+
+def layout_cols(layout, cols=register_cols):
+    # the columns of the register to read for cols, given where layout found them
+    return sorted(set(layout[default_layout.index(col)] for col in cols))
+
+
+def apply_layout(sheet, layout, cols=register_cols):
+    # the columns of sheet (labeled by position) moved to where the parser reads them, given where layout found them
+    import numpy as np
+    import pandas as pd
+
+    positions = dict(zip(default_layout, layout))
+    excel_file = pd.DataFrame({col: sheet[positions[col]] if positions[col] in sheet.columns else pd.Series(None, index=sheet.index, dtype=object) for col in cols}, index=sheet.index)
+    # the other columns may have run further down than these
+    filled_rows = np.flatnonzero(excel_file.notna().any(axis=1).to_numpy())
+    return excel_file.iloc[:filled_rows[-1] + 1 if len(filled_rows) else 0]
+
+
+def layout_problems(excel_file, whole_sheet=True):
+    # Fields of a loaded register whose columns don't hold what they should, judged from the employee and marker rows only.
+    # Used to check a layout fits, an empty list means it does. Without whole_sheet, excel_file is only the top of a
+    # register and the grand total isn't looked for.
+    import numpy as np
+    import pandas as pd
+
+    def marker_rows(col, marker):
+        return np.flatnonzero(np.char.find(excel_file[col].to_numpy(dtype=object).astype(str), marker) >= 0)
+
+    def has_numbers(col, rows):
+        rows = rows[(rows >= 0) & (rows < len(excel_file))]
+        cell_text = excel_file[col].to_numpy(dtype=object)[rows].astype(str)
+        return bool((~np.isnan(pd.to_numeric(np.char.replace(cell_text, ',', ''), errors='coerce'))).any()) if len(rows) else False
+
+    # employees are found the way the parser finds them, any value in the employee name column
+    employee_rows = np.flatnonzero(excel_file[employee_name_col].notna().to_numpy())
+    total_rows = marker_rows(employee_total_col, "Employee Tot:")
+    futa_rows = marker_rows(futa_col, "FUTA")
+    grand_total_rows = marker_rows(grand_total_col, "Grand Tot:")
+    checks = {
+        'program': len(employee_rows) > 0 and bool(excel_file[program_col].iloc[employee_rows].notna().all()),
+        'employee_total': len(total_rows) > 0,
+        'futa': len(futa_rows) > 0,
+        'grand_total': len(grand_total_rows) > 0,
+        'employee_name': len(employee_rows) > 0 and has_numbers(net_pay_col, employee_rows[:1] + 1),
+        'department_title': bool(excel_file[department_title_col].notna().any()),
+        'hours_worked': has_numbers(hours_worked_col, np.arange(len(excel_file))),
+        'net_pay': has_numbers(net_pay_col, employee_rows + 1),
+        'gross_pay': has_numbers(gross_pay_col, total_rows),
+        'taxes': has_numbers(taxes_col, total_rows),
+        'deductions': has_numbers(deductions_col, total_rows),
+        'employer_tax': has_numbers(employer_tax_col, futa_rows),
+        'grand_total_net': has_numbers(grand_total_net_col, grand_total_rows + 2),
+    }
+    if not whole_sheet:
+        for field in grand_total_fields:
+            del checks[field]
+    return [field for field in default_layout._fields if not checks.get(field, True)]
+
+
+def layout_note(layout):
+    # the columns that differ from the built-in ones, as a message, or None when there are none
+    moved = [f"{field} {default_col} -> {col}" for field, default_col, col in zip(default_layout._fields, default_layout, layout) if col != default_col]
+    if not moved:
+        return None
+    return f"Note: Columns were found away from where they usually are ({', '.join(moved)})."
+
+
+class LayoutCache:
+    # Detected layouts by header fingerprint, most recently detected first, in one small JSON file shared by every run.
+    def __init__(self, path=None):
+        self.path = path or os.path.join(default_cache_dir, layout_cache_name)
+
+    def read(self):
+        try:
+            with open(self.path) as layout_file:
+                return json.load(layout_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, fingerprint):
+        return [RegisterLayout(**layout) for layout in self.read().get(fingerprint, [])]
+
+    def put(self, fingerprint, layout):
+        layouts = self.read()
+        known = [known_layout for known_layout in layouts.get(fingerprint, []) if known_layout != layout._asdict()]
+        layouts[fingerprint] = [layout._asdict()] + known[:layouts_per_fingerprint - 1]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as layout_file:
+            json.dump(layouts, layout_file, indent=1)
+        os.replace(temp_path, self.path)
+
+
+def load_detected_layout(path, sheet_name, engine, cols, layouts):
+    # The register's columns found by fingerprint or detection from its top rows, then only those columns loaded and moved
+    # to where the parser reads them. When nothing can be detected the built-in columns are loaded, same as --layout fixed.
+    top = read_register_columns(path, sheet_name, engine, max_row=layout_scan_rows)
+    text, is_number = sheet_cells(top)
+    employee_row = first_employee_row(text, is_number)
+    fingerprint = header_fingerprint(text, employee_row) if employee_row is not None else None
+    # the first cached layout that fits the top of the register
+    candidates = layouts.get(fingerprint) if fingerprint is not None else []
+    cached = next((candidate for candidate in candidates if not layout_problems(apply_layout(top, candidate), whole_sheet=False)), None)
+    layout = cached
+    if layout is None:
+        try:
+            layout = detect_layout(text, is_number, employee_row)
+        except ValueError as e:
+            excel_file = read_register_columns(path, sheet_name, engine, cols)
+            excel_file.attrs['layout_note'] = f"Warning: Could not detect the column layout ({e}), reading the built-in columns."
+            return excel_file
+
+    excel_file = apply_layout(read_register_columns(path, sheet_name, engine, layout_cols(layout, cols)), layout, cols)
+    problems = layout_problems(excel_file)
+    if problems and set(problems) <= set(grand_total_fields):
+        # the grand total didn't move with the columns next to it, find it in the whole sheet
+        sheet = read_register_columns(path, sheet_name, engine)
+        try:
+            layout = detect_grand_total_layout(sheet, layout)
+        except ValueError:
+            pass
+        excel_file = apply_layout(sheet, layout, cols)
+        problems = layout_problems(excel_file)
+
+    if problems:
+        excel_file.attrs['layout_note'] = f"Warning: The {', '.join(problems)} column{'s' if len(problems) > 1 else ''} of the detected layout don't hold what they should, check the totals carefully."
+        return excel_file
+    if fingerprint is not None and layout != cached:
+        layouts.put(fingerprint, layout)
+    excel_file.attrs['layout_note'] = layout_note(layout)
+    return excel_file
+
+
+class NumericColumns:
+    # The numeric columns of a sheet converted to floats once, with commas stripped and blanks turned into NaN in bulk.
+    # arrays holds the float64 columns for vectorized work, values holds the same numbers as lists (None for blanks) for cell reads.
+    def __init__(self, excel_file, cols=numeric_cols):
+        import numpy as np
+        import pandas as pd
+
+        self.arrays = {}
+        self.values = {}
+        for col in cols:
+            cell_text = np.char.replace(excel_file[col].to_numpy(dtype=object).astype(str), ',', '')
+            column = np.round(pd.to_numeric(cell_text, errors='coerce').astype(np.float64), 2)
+            self.arrays[col] = column
+            self.values[col] = np.where(np.isnan(column), None, column).tolist()
+
+    def get_num(self, row, col):
+        return self.values[col][row]
+
+
+# PROFILING
+class Profiler:
+    # Wall time per stage and a few hot-path counters, for --profile. Functions take profiler=None and only
+    # time their inner steps when a profiler is passed in, so normal runs don't pay for it.
+    # Stage names use dots for nesting, "parse.employee_scan" is part of "parse".
+    def __init__(self):
+        self.stage_seconds = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        # registered on entry, so the table lists a stage before the stages inside it
+        self.stage_seconds.setdefault(name, 0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_max(self, name, value):
+        self.counters[name] = max(self.counters.get(name, value), value)
+
+    def summary(self):
+        counters = dict(self.counters)
+        if counters.get('employees'):
+            counters['rows_scanned_per_employee'] = round(counters.get('rows_scanned', 0) / counters['employees'], 2)
+        return {
+            'total_seconds': sum(seconds for name, seconds in self.stage_seconds.items() if '.' not in name),
+            'stages': dict(self.stage_seconds),
+            'counters': counters,
+        }
+
+    def format_table(self):
+        summary = self.summary()
+        total = summary['total_seconds'] or 1
+        lines = [f"{'stage':<40} {'seconds':>10} {'% of run':>9}"]
+        for name, seconds in summary['stages'].items():
+            depth = name.count('.')
+            label = '  ' * depth + name.rsplit('.', 1)[-1]
+            lines.append(f"{label:<40} {seconds:>10.4f} {seconds / total * 100:>8.1f}%")
+        lines.append(f"{'total':<40} {summary['total_seconds']:>10.4f}")
+        lines.append('')
+        lines.append(f"{'counter':<40} {'value':>10}")
+        for name, value in summary['counters'].items():
+            lines.append(f"{name:<40} {value:>10}")
+        return "\n".join(lines)
+
+
+def profile_stage(profiler, name):
+    # profiler.stage(name), or nothing at all when we aren't profiling
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+class CountedCells:
+    # NumericColumns.values ({col: numbers}) for a profiled parse: the same numbers, but every cell read through get_num or
+    # values[col][row] is counted in reads
+    def __init__(self, values):
+        self.numbers = values
+        self.values = {col: CountedColumn(self, column) for col, column in values.items()}
+        self.reads = 0
+
+    def get_num(self, row, col):
+        self.reads += 1
+        return self.numbers[col][row]
+
+
+class CountedColumn:
+    # one column of CountedCells.values
+    __slots__ = ('cells', 'values')
+
+    def __init__(self, cells, values):
+        self.cells = cells
+        self.values = values
+
+    def __getitem__(self, row):
+        self.cells.reads += 1
+        return self.values[row]
+
+    def __len__(self):
+        return len(self.values)
+
+
+# PARSER EVENTS
+# The register is read top to bottom exactly once. Every row is handed to a small state machine which
+# emits these events as soon as it knows enough about them.
+DepartmentStart = namedtuple('DepartmentStart', ['row', 'name'])
+ProgramLine = namedtuple('ProgramLine', ['row', 'employee_row', 'name', 'gross_pay', 'hours'])
+EmployeeTotal = namedtuple('EmployeeTotal', ['row', 'employee_row', 'gross_pay', 'taxes', 'deductions', 'employer_taxes'])
+EmployerTaxLine = namedtuple('EmployerTaxLine', ['row', 'label', 'amount'])
+EmployeeBlock = namedtuple('EmployeeBlock', ['row', 'last_program_row', 'number', 'name', 'net_pay', 'per_program_gross_pay', 'total', 'employer_futa'])
+GrandTotal = namedtuple('GrandTotal', ['row', 'gross_pay', 'taxes', 'deductions', 'employer_taxes', 'net_pay', 'employer_futa', 'ca_ett'])
+
+# the program name search gives up after this many empty rows
+max_program_name_offset = 100
+
+# marker text and the column it can be found in
+marker_columns = {
+    "FUTA": futa_col,
+    "CA ETT": futa_col,
+    "Employee Tot:": employee_total_col,
+    "Grand Tot:": grand_total_col,
+}
+
+
+class MarkerIndex:
+    # Sorted row numbers of every marker row in a sheet. Built once per sheet so finding
+    # "the next FUTA row after this employee" is a binary search instead of a forward scan.
+    def __init__(self, excel_file):
+        import numpy as np
+
+        self.rows = {}
+        for marker, col in marker_columns.items():
+            cell_text = excel_file[col].to_numpy(dtype=object).astype(str)
+            self.rows[marker] = np.flatnonzero(np.char.find(cell_text, marker) >= 0).tolist()
+
+    def next_row(self, marker, row):
+        # first row at or after `row` containing the marker, None if there isn't one
+        marker_rows = self.rows[marker]
+        i = bisect_left(marker_rows, row)
+        if i < len(marker_rows):
+            return marker_rows[i]
+        return None
+
+    def last_row(self, marker, start_row, end_row):
+        # last row in [start_row, end_row] containing the marker, None if there isn't one
+        marker_rows = self.rows[marker]
+        i = bisect_right(marker_rows, end_row)
+        if i > 0 and marker_rows[i - 1] >= start_row:
+            return marker_rows[i - 1]
+        return None
+
+
+class EmployeeBlockState:
+    # Everything we know about an employee while their block is still being read.
+    # A block is finished once we have read their "Employee Tot:" row and found the names of all their programs.
+    def __init__(self, row, name, number, net_pay, total_row, employer_futa):
+        self.row = row
+        self.name = name
+        self.number = number
+        self.net_pay = net_pay
+        self.total_row = total_row
+        self.employer_futa = employer_futa
+        self.total = None
+        self.last_program_row = None
+        self.name_row_offset = 0
+        self.name_offset_retries = 0  # empty rows skipped looking for program names
+        self.pending_program_rows = deque()  # rows with pay or hours still waiting on their program name
+        self.program_names = deque()         # program names seen in column B that have not been used yet
+        self.per_program_gross_pay = {}
+
+    def is_finished(self):
+        return self.total is not None and not self.pending_program_rows
+
+
+def resolve_program_names(state, row, report):
+    # Pair rows with pay/hours to their program names. The name may not be in line with the gross pay if the number of
+    # programs is too small for a given employee, so we keep a running offset and look further down when the cell is empty.
+    while state.pending_program_rows:
+        program_row, gross_pay, hours = state.pending_program_rows[0]
+        first_name_row = program_row + state.name_row_offset
+        while state.program_names and state.program_names[0][0] < first_name_row:
+            state.program_names.popleft()
+
+        program_name = None
+        if state.program_names and state.program_names[0][0] - first_name_row <= max_program_name_offset:
+            name_row, program_name = state.program_names.popleft()
+            state.name_offset_retries += name_row - first_name_row
+            state.name_row_offset = name_row - program_row
+            if "Polka Dots" in program_name:
+                program_name = "Polkadots"
+        elif state.program_names or row >= first_name_row + max_program_name_offset:
+            report(f"ERROR: Unable to find program for listed gross pay for {state.name}: ${gross_pay}")
+            state.name_offset_retries += max_program_name_offset + 1
+            state.name_row_offset += max_program_name_offset + 1
+        else:
+            # the name is further down than we have read so far
+            return
+        state.pending_program_rows.popleft()
+
+        if hours is None:
+            # If we have pay but no hours, it was a bonus of some kind.
+            if gross_pay is not None:
+                state.per_program_gross_pay[program_name] = gross_pay
+        else:
+            # But if we have hours
+            if gross_pay is None:
+                # AND our pay is empty, that means we don't have a pay rate for the hours reported and our employee did not get money they earned.
+                report(f"\n!!! ERROR! {state.name} has {hours} hours reported for {program_name} but earned $0. Check their pay rate for that category.")
+            else:
+                # All is good, we have hours, we have pay. Things are great
+                state.per_program_gross_pay[program_name] = gross_pay
+
+        yield ProgramLine(program_row, state.row, program_name, gross_pay, hours)
+
+
+def advance_employee_block(state, row, block_columns, report, timings=None):
+    # Feed one row to an open employee block, yields the EmployeeTotal and ProgramLine events it completes.
+    # block_columns is (get_num, gross pay values, hours values, has program name, program cells) for the rows being parsed.
+    get_num, gross_pay_values, hours_values, has_program_name, program_cells = block_columns
+    if state.total is None and row >= state.row + 2:
+        if row == state.total_row:
+            state.last_program_row = row - 1
+            state.total = EmployeeTotal(row, state.row, get_num(row, gross_pay_col), get_num(row, taxes_col), get_num(row, deductions_col), get_num(row, employer_tax_col))
+            yield state.total
+        else:
+            # check if this is a program row that has payment or hours for this pay period
+            gross_pay = gross_pay_values[row]
+            hours = hours_values[row]
+            if gross_pay is not None or hours is not None:
+                state.pending_program_rows.append((row, gross_pay, hours))
+
+    if state.pending_program_rows:
+        if has_program_name[row]:
+            state.program_names.append((row, str(program_cells[row])))
+        if timings is not None:
+            program_name_start = time.perf_counter()
+            program_lines = list(resolve_program_names(state, row, report))
+            timings['program_name_search'] += time.perf_counter() - program_name_start
+            yield from program_lines
+        else:
+            yield from resolve_program_names(state, row, report)
+
+
+def department_name(title):
+    if 'TumbleBunnies' in title:
+        return 'Tumblebunny'
+    return str(title)
+
+
+def read_grand_total(marker_index, get_num, n_rows):
+    # GRAND TOTAL: stated FUTA is the last FUTA line before the CA ETT line that follows "Grand Tot:". None without a "Grand Tot:" row.
+    grand_total_row = marker_index.next_row("Grand Tot:", 0)
+    if grand_total_row is None:
+        return None
+    ca_ett_row = marker_index.next_row("CA ETT", grand_total_row)
+    stated_futa_row = marker_index.last_row("FUTA", grand_total_row, n_rows if ca_ett_row is None else ca_ett_row)
+    row = grand_total_row
+    return GrandTotal(row, get_num(row, gross_pay_col), get_num(row, taxes_col), get_num(row, deductions_col), get_num(row, employer_tax_col), get_num(row + 2, grand_total_net_col),
+                      get_num(stated_futa_row, employer_tax_col) if stated_futa_row is not None else None,
+                      get_num(ca_ett_row, employer_tax_col) if ca_ett_row is not None else None)
+
+
+def parse_register(excel_file, marker_index=None, numbers=None, messages=None, profiler=None):
+    # Single pass over the register, yields the events above in row order. Errors go to messages, or are printed when it is None.
+    report = print if messages is None else messages.append
+    timed = profiler is not None
+    futa_lookup_seconds = 0
+    timings = {'program_name_search': 0} if timed else None
+    # hot-path counters, only added up per employee so the row loop stays the same
+    rows_scanned = 0
+    name_offset_retries = 0
+    employee_count = 0
+    most_rows_scanned = 0
+    if marker_index is None:
+        marker_index = MarkerIndex(excel_file)
+    if numbers is None:
+        numbers = NumericColumns(excel_file)
+    if timed:
+        numbers = CountedCells(numbers.values)
+    get_num = numbers.get_num
+    gross_pay_values = numbers.values[gross_pay_col]
+    hours_values = numbers.values[hours_worked_col]
+
+    department_titles = excel_file[department_title_col].to_numpy()
+    has_department_title = excel_file[department_title_col].notna().to_numpy()
+    employee_names = excel_file[employee_name_col].to_numpy()
+    has_employee_name = excel_file[employee_name_col].notna().to_numpy()
+    program_cells = excel_file[program_col].to_numpy()
+    has_program_name = excel_file[program_col].notna().to_numpy()
+    block_columns = (get_num, gross_pay_values, hours_values, has_program_name, program_cells)
+
+    # FUTA / CA ETT lines sit in the employer tax section of each employee and again under the grand total
+    employer_tax_labels = {row: "CA ETT" for row in marker_index.rows["CA ETT"]}
+    employer_tax_labels.update({row: "FUTA" for row in marker_index.rows["FUTA"]})
+
+    grand_total = read_grand_total(marker_index, get_num, len(excel_file))
+
+    open_employees = []
+
+    for row in range(len(excel_file)):
+        # DEPARTMENTS: any value in column F signals entry into a new department
+        if has_department_title[row]:
+            yield DepartmentStart(row, department_name(department_titles[row]))
+
+        # EMPLOYEES: any value in column G signals a new employee
+        if has_employee_name[row]:
+            # the totals are on the first "Employee Tot:" row after the first program row
+            total_row = marker_index.next_row("Employee Tot:", row + 3)
+            if timed:
+                futa_lookup_start = time.perf_counter()
+            futa_row = marker_index.next_row("FUTA", row)
+            employer_futa = get_num(futa_row, employer_tax_col) if futa_row is not None else None
+            if timed:
+                futa_lookup_seconds += time.perf_counter() - futa_lookup_start
+            open_employees.append(EmployeeBlockState(row, employee_names[row], extract_number_from_string(str(program_cells[row])), get_num(row + 1, net_pay_col), total_row, employer_futa))
+
+        if row in employer_tax_labels:
+            yield EmployerTaxLine(row, employer_tax_labels[row], get_num(row, employer_tax_col))
+
+        for state in open_employees:
+            yield from advance_employee_block(state, row, block_columns, report, timings)
+
+        if any(state.is_finished() for state in open_employees):
+            still_open = []
+            for state in open_employees:
+                if state.is_finished():
+                    if timed:
+                        employee_rows = row - state.row + 1
+                        employee_count += 1
+                        rows_scanned += employee_rows
+                        most_rows_scanned = max(most_rows_scanned, employee_rows)
+                        name_offset_retries += state.name_offset_retries
+                    yield EmployeeBlock(state.row, state.last_program_row, state.number, state.name, state.net_pay, state.per_program_gross_pay, state.total, state.employer_futa)
+                else:
+                    still_open.append(state)
+            open_employees = still_open
+
+        if grand_total is not None and row == grand_total.row:
+            yield grand_total
+
+    for state in open_employees:
+        if state.total is None:
+            report(f"ERROR: Reached the end of the register before finding the Employee Tot: row for {state.name}.")
+        else:
+            yield EmployeeBlock(state.row, state.last_program_row, state.number, state.name, state.net_pay, state.per_program_gross_pay, state.total, state.employer_futa)
+
+    if timed:
+        profiler.add_time('parse.employee_scan.futa_lookup', futa_lookup_seconds)
+        profiler.add_time('parse.employee_scan.program_name_search', timings['program_name_search'])
+        profiler.count('employees', employee_count)
+        profiler.count('rows_scanned', rows_scanned)
+        profiler.count_max('most_rows_scanned_for_one_employee', most_rows_scanned)
+        profiler.count('cells_read', numbers.reads)
+        profiler.count('program_name_offset_retries', name_offset_retries)
+
+
+# PARALLEL BLOCK PARSING
+# Every employee block, from the name row to its "Employee Tot:" row and the program names under it, can be read on
+# its own once we know where it starts. One cheap scan finds the starts, then the blocks are parsed in chunks on a
+# process pool and merged back in row order, so the result is the same no matter how many workers there are.
+
+# where a block starts, the row its totals are on and the employee's FUTA amount
+EmployeeBlockBounds = namedtuple('EmployeeBlockBounds', ['row', 'total_row', 'employer_futa'])
+
+# a run of consecutive blocks and the rows they are read from, sheet rows first_row onward
+BlockChunk = namedtuple('BlockChunk', ['first_row', 'bounds', 'numbers', 'program_cells', 'has_program_name', 'employee_names', 'reaches_sheet_end'])
+
+# numeric columns read inside an employee block
+block_numeric_cols = [net_pay_col, hours_worked_col, gross_pay_col, taxes_col, deductions_col, employer_tax_col]
+
+# chunks handed out per worker, more than one so a slow chunk doesn't hold up the rest
+chunks_per_worker = 4
+
+
+def find_employee_blocks(excel_file, marker_index, numbers):
+    # one vectorized pass over the employee name column, plus two binary searches per employee
+    import numpy as np
+
+    get_num = numbers.get_num
+    bounds = []
+    for row in np.flatnonzero(excel_file[employee_name_col].notna().to_numpy()).tolist():
+        futa_row = marker_index.next_row("FUTA", row)
+        bounds.append(EmployeeBlockBounds(row, marker_index.next_row("Employee Tot:", row + 3), get_num(futa_row, employer_tax_col) if futa_row is not None else None))
+    return bounds
+
+
+def parse_employee_block(bounds, block_columns, employee_names, n_rows, report):
+    # Read one block on its own, the same way parse_register does. Returns the EmployeeBlockState it ended in.
+    get_num, _, _, _, program_cells = block_columns
+    row = bounds.row
+    state = EmployeeBlockState(row, employee_names[row], extract_number_from_string(str(program_cells[row])), get_num(row + 1, net_pay_col), bounds.total_row, bounds.employer_futa)
+    for row in range(bounds.row, n_rows):
+        for _ in advance_employee_block(state, row, block_columns, report):
+            pass
+        if state.is_finished():
+            break
+    state.rows_scanned = row - bounds.row + 1
+    return state
+
+
+def count_block(counts, state):
+    # add one finished block to the parser counters parse_block_chunk and parse_register_parallel keep for --profile
+    counts['employees'] += 1
+    counts['rows_scanned'] += state.rows_scanned
+    counts['most_rows_scanned'] = max(counts['most_rows_scanned'], state.rows_scanned)
+    counts['program_name_offset_retries'] += state.name_offset_retries
+
+
+def finished_block(state, report):
+    # the EmployeeBlock for a state parse_employee_block is done with, None when its totals were never found
+    if state.total is None:
+        report(f"ERROR: Reached the end of the register before finding the Employee Tot: row for {state.name}.")
+        return None
+    return EmployeeBlock(state.row, state.last_program_row, state.number, state.name, state.net_pay, state.per_program_gross_pay, state.total, state.employer_futa)
+
+
+def parse_block_chunk(chunk, timed=False):
+    # Runs in a worker process. Rows are counted from the start of the chunk while parsing and moved back to sheet rows after.
+    # Returns one (block, messages) pair per bounds. Both are None when the chunk ended before the block did and it has to be
+    # parsed again against the whole sheet. With timed, also returns the parser counters for --profile, else None.
+    first_row = chunk.first_row
+    values = chunk.numbers
+    counts = dict(employees=0, rows_scanned=0, most_rows_scanned=0, program_name_offset_retries=0, cells_read=0) if timed else None
+
+    def get_num(row, col):
+        return values[col][row]
+
+    if timed:
+        cells = CountedCells(values)
+        values = cells.values
+        get_num = cells.get_num
+
+    block_columns = (get_num, values[gross_pay_col], values[hours_worked_col], chunk.has_program_name, chunk.program_cells)
+    n_rows = len(chunk.program_cells)
+    parsed = []
+    for bounds in chunk.bounds:
+        local_bounds = bounds._replace(row=bounds.row - first_row, total_row=bounds.total_row - first_row if bounds.total_row is not None else None)
+        messages = []
+        state = parse_employee_block(local_bounds, block_columns, chunk.employee_names, n_rows, messages.append)
+        if not state.is_finished() and not chunk.reaches_sheet_end:
+            parsed.append((None, None))
+            continue
+        if timed and state.is_finished():
+            count_block(counts, state)
+        block = finished_block(state, messages.append)
+        if block is not None:
+            total = block.total._replace(row=block.total.row + first_row, employee_row=block.total.employee_row + first_row)
+            block = block._replace(row=block.row + first_row, last_program_row=block.last_program_row + first_row, total=total)
+        parsed.append((block, messages))
+    if timed:
+        counts['cells_read'] = cells.reads
+    return parsed, counts
+
+
+def block_chunks(bounds, excel_file, numbers, n_chunks):
+    # Split the blocks into n_chunks runs of consecutive blocks, each with the rows it needs: from its first block to past its
+    # last "Employee Tot:" row, far enough for the program name search.
+    n_rows = len(excel_file)
+    program_cells = excel_file[program_col].to_numpy()
+    has_program_name = excel_file[program_col].notna().to_numpy()
+    employee_names = excel_file[employee_name_col].to_numpy()
+    chunk_size = max(1, -(-len(bounds) // n_chunks))
+    for start in range(0, len(bounds), chunk_size):
+        chunk_bounds = bounds[start:start + chunk_size]
+        first_row = chunk_bounds[0].row
+        if any(block.total_row is None for block in chunk_bounds):
+            end_row = n_rows
+        else:
+            end_row = min(n_rows, max(block.total_row for block in chunk_bounds) + max_program_name_offset + 2)
+        yield BlockChunk(first_row, chunk_bounds, {col: numbers.values[col][first_row:end_row] for col in block_numeric_cols}, program_cells[first_row:end_row],
+                         has_program_name[first_row:end_row], employee_names[first_row:end_row], end_row == n_rows)
+
+
+def parse_register_parallel(excel_file, marker_index, numbers, workers, profiler=None):
+    # Departments, (block, messages) pairs in row order and the grand total, with the blocks parsed on a process pool.
+    # With a profiler the workers count what they read too, and the counts are added up here the way parse_register counts them.
+    import numpy as np
+
+    timed = profiler is not None
+    counts = dict(employees=0, rows_scanned=0, most_rows_scanned=0, program_name_offset_retries=0, cells_read=0)
+    # the chunks are sliced from the plain numbers, the workers count their own reads
+    chunk_numbers = numbers
+    if timed:
+        numbers = CountedCells(numbers.values)
+
+    department_titles = excel_file[department_title_col].to_numpy()
+    departments = [DepartmentStart(row, department_name(department_titles[row])) for row in np.flatnonzero(excel_file[department_title_col].notna().to_numpy()).tolist()]
+    grand_total = read_grand_total(marker_index, numbers.get_num, len(excel_file))
+
+    bounds = find_employee_blocks(excel_file, marker_index, numbers)
+    parsed = []
+    if bounds:
+        workers = workers or os.cpu_count() or 1
+        chunks = list(block_chunks(bounds, excel_file, chunk_numbers, workers * chunks_per_worker))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_parsed, chunk_counts in executor.map(parse_block_chunk, chunks, [timed] * len(chunks)):
+                parsed.extend(chunk_parsed)
+                if timed:
+                    counts['most_rows_scanned'] = max(counts['most_rows_scanned'], chunk_counts.pop('most_rows_scanned'))
+                    for name, amount in chunk_counts.items():
+                        counts[name] += amount
+
+    # blocks whose program names ran past the end of their chunk, read again against the whole sheet
+    block_columns = (numbers.get_num, numbers.values[gross_pay_col], numbers.values[hours_worked_col], excel_file[program_col].notna().to_numpy(), excel_file[program_col].to_numpy())
+    employee_names = excel_file[employee_name_col].to_numpy()
+    for i, (block, messages) in enumerate(parsed):
+        if messages is None:
+            messages = []
+            state = parse_employee_block(bounds[i], block_columns, employee_names, len(excel_file), messages.append)
+            if timed and state.is_finished():
+                count_block(counts, state)
+            parsed[i] = (finished_block(state, messages.append), messages)
+
+    if timed:
+        profiler.count('employees', counts['employees'])
+        profiler.count('rows_scanned', counts['rows_scanned'])
+        profiler.count_max('most_rows_scanned_for_one_employee', counts['most_rows_scanned'])
+        profiler.count('cells_read', counts['cells_read'] + numbers.reads)
+        profiler.count('program_name_offset_retries', counts['program_name_offset_retries'])
+    return departments, parsed, grand_total
+
+
+# categories that are allocated to the employee's default department
+map_to_default_department = object()
+
+default_rules_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'WageDistributionRules.json')
+
+
+def parse_share(share):
+    # shares can be written as fractions ("2/3") in the rules file
+    return float(Fraction(str(share)))
+
+
+class AllocationRules:
+    # The category -> program rules from WageDistributionRules.json, compiled into lookup tables once per run.
+    # Each distinct pay category is only resolved once, after that it is a dictionary lookup.
+    def __init__(self, config):
+        self.config = config  # what the rules were compiled from, scenarios start from it
+        self.tracked_programs = list(config['tracked_programs'])
+        self.split_programs = list(config['split_programs'])
+        self.contains_rules = [(tuple(rule['contains']), rule['program']) for rule in config.get('contains_rules', [])]
+        # employee ids are read from the register as text
+        self.special_cases = {str(employee_id): special_case for employee_id, special_case in config.get('special_case_employees', {}).items()}
+        for employee_id, special_case in self.special_cases.items():
+            # a category can be split and reassigned, but not more than all of it
+            category_shares = {}
+            for move in [special_case.get('split'), special_case.get('reassign')]:
+                if move is not None:
+                    category_shares[move['category']] = category_shares.get(move['category'], 0) + Fraction(str(move['share']))
+            for category, share in category_shares.items():
+                if not 0 <= share <= 1:
+                    raise ValueError(f"special case {employee_id} moves a share of {share} of {category}, it has to be between 0 and 1")
+
+        self.category_programs = {program: program for program in self.tracked_programs}
+        # categories pinned to a program, ahead of every other rule
+        self.category_programs.update(config.get('category_programs', {}))
+        for category in config.get('map_to_default', []):
+            self.category_programs.setdefault(category, map_to_default_department)
+
+    @classmethod
+    def load(cls, path=default_rules_file):
+        with open(path) as rules_file:
+            return cls(json.load(rules_file))
+
+    def resolve(self, category):
+        # program for a pay category, map_to_default_department, or None when no rule matches
+        try:
+            return self.category_programs[category]
+        except KeyError:
+            pass
+        program = None
+        if isinstance(category, str):
+            for substrings, rule_program in self.contains_rules:
+                if any(substring in category for substring in substrings):
+                    program = rule_program
+                    break
+        self.category_programs[category] = program
+        return program
+
+    def apply_special_case(self, employee_id, program_cents, default_department):
+        # Move pay around for the few employees listed in the rules file. Takes and returns the employee's {category: cents},
+        # which is copied rather than changed, and their default department. Also returns {program: cents} for the split programs.
+        # Amounts are whole cents, so what is split and reassigned adds up to exactly what was taken out. Whatever the shares
+        # leave of a category stays in it and is mapped like any other pay.
+        special_case = self.special_cases[employee_id]
+        program_cents = dict(program_cents)
+        split_amounts = {}
+        taken = {}  # (share, cents) already moved out of each category
+
+        def take(category, share):
+            # cents moved out of a category. The share that brings a category to all of it gets whatever is left, so no cent is lost to rounding
+            category_cents = program_cents.get(category, 0)
+            taken_share, taken_cents = taken.get(category, (0, 0))
+            cents = category_cents - taken_cents if taken_share + share == 1 else round(category_cents * share)
+            taken[category] = (taken_share + share, taken_cents + cents)
+            return cents
+
+        split = special_case.get('split')
+        if split is not None:
+            split_programs = split.get('programs', self.split_programs)
+            split_amounts = dict(zip(split_programs, split_evenly(take(split['category'], parse_share(split['share'])), len(split_programs))))
+
+        reassign = special_case.get('reassign')
+        if reassign is not None:
+            reassigned = take(reassign['category'], parse_share(reassign['share']))
+            program_cents[reassign['program']] = program_cents.get(reassign['program'], 0) + reassigned
+
+        for category, (_, taken_cents) in taken.items():
+            remaining = program_cents.get(category, 0) - taken_cents
+            if remaining:
+                program_cents[category] = remaining
+            else:
+                program_cents.pop(category, None)
+
+        return program_cents, special_case.get('default_department', default_department), split_amounts
+
+
+# MONEY: amounts are whole cents in int64 arrays from the allocation onward, so totals add up exactly.
+# Anything that is split (taxes, employer taxes, deductions, special case pay) is split with the largest remainder
+# method: every part is rounded down and the cents left over go to the parts that lost the most to rounding.
+def to_cents(dollars):
+    # dollars (a number or an array of them, already rounded to the cent) as int64 cents. A missing (None or NaN) or
+    # infinite amount raises ValueError, casting it would give INT64_MIN.
+    import numpy as np
+
+    dollars = np.asarray(dollars, dtype=np.float64)
+    if not np.isfinite(dollars).all():
+        raise ValueError(f"can't convert a missing or infinite amount to cents: {dollars[~np.isfinite(dollars)][:3].tolist()}")
+    return np.rint(dollars * 100).astype(np.int64)
+
+
+def format_dollars(cents):
+    if cents is None:
+        return 'None'
+    return f"{cents / 100:.2f}"
+
+
+def split_evenly(cents, parts):
+    # cents split into parts whole cent amounts that add up to cents, the leftover cents go to the first parts
+    base, leftover = divmod(cents, parts)
+    return [base + 1 if part < leftover else base for part in range(parts)]
+
+
+def largest_remainder_split(totals, weights):
+    # Split every row's total (int64 cents) over its columns in proportion to the int64 weights, so that each row adds up
+    # to exactly its total. A negative weight gets a negative part, the same as multiplying by the row's rate would give.
+    # Leftover cents go to the largest remainders, ties to the leftmost column. Rows whose weights add up to 0 get nothing.
+    import numpy as np
+
+    # the same proportions with a positive sum, so the parts are rounded down and the remainders are never negative
+    weights = np.where((weights.sum(axis=1) < 0)[:, None], -weights, weights)
+    weight_sums = weights.sum(axis=1)
+    divisors = np.where(weight_sums == 0, 1, weight_sums)[:, None]
+    shares = totals[:, None] * weights
+    parts = shares // divisors
+    remainders = shares - parts * divisors
+    leftover = np.where(weight_sums == 0, 0, totals - parts.sum(axis=1))
+    # rank of every column's remainder within its row, largest first
+    ranks = np.empty_like(parts)
+    np.put_along_axis(ranks, np.argsort(-remainders, axis=1, kind='stable'), np.broadcast_to(np.arange(weights.shape[1]), weights.shape), axis=1)
+    return parts + (ranks < leftover[:, None])
+
+
+class ProgramAllocation:
+    # Every employee's pay split across programs in cents. Employees are rows and programs are columns.
+    def __init__(self, programs, gross, taxes, employer_taxes, net, unapplied_deductions):
+        self.programs = programs
+        self.gross = gross
+        self.taxes = taxes
+        self.employer_taxes = employer_taxes
+        self.net = net
+        self.unapplied_deductions = unapplied_deductions  # one row per employee, see allocate_programs
+
+    def program_cents(self, values):
+        return dict(zip(self.programs, values.sum(axis=0).tolist()))
+
+    def by_program(self, values):
+        # {program: dollars}
+        return {program: cents / 100 for program, cents in self.program_cents(values).items()}
+
+
+def allocate_programs(employees, mapped_program_gross, tracked_programs):
+    # employees is an EmployeeTable, mapped_program_gross has one {program: gross pay in cents} dict per employee, in the order the programs were added.
+    import numpy as np
+
+    programs = list(tracked_programs)
+    program_cols = {program: col for col, program in enumerate(programs)}
+    rows = []
+    cols = []
+    values = []
+    added_order = []
+    for row, employee_mapped_program_gross in enumerate(mapped_program_gross):
+        for order, (program, program_gross) in enumerate(employee_mapped_program_gross.items()):
+            if program not in program_cols:
+                program_cols[program] = len(programs)
+                programs.append(program)
+            rows.append(row)
+            cols.append(program_cols[program])
+            values.append(program_gross)
+            added_order.append(order)
+
+    shape = (len(employees), len(programs))
+    gross = np.zeros(shape, dtype=np.int64)
+    gross[rows, cols] = values
+    present = np.zeros(shape, dtype=bool)
+    present[rows, cols] = True
+    # programs an employee doesn't have sort after the ones they do
+    program_order = np.full(shape, len(programs))
+    program_order[rows, cols] = added_order
+
+    employee_gross = employees.gross_pay
+    employee_net = employees.net_pay
+    employee_deductions = employees.deductions
+    employee_employer_taxes = employees.employer_taxes_minus_futa
+
+    # Split tax for each program. Tax is per employee (whatever gross pay doesn't cover of net pay and deductions), not per program, so this is ok
+    # Every program gets program gross * the employee's tax rate, so a negative adjustment line takes back its share of the tax.
+    taxes = largest_remainder_split(employee_gross - employee_net - employee_deductions, gross)
+    # In order to properly classify employer taxes into their correct program, we need to know how much of the income came from a certain program
+    employer_taxes = largest_remainder_split(employee_employer_taxes, gross)
+
+    # DEDUCTIONS: programs are walked smallest to largest, each one takes an even share of what is left to deduct.
+    # When a program can't cover its share it gives up all of its net pay and the rest is spread over the larger programs.
+    # Shares are whole cents, rounded down, so the largest program picks up the leftover cents.
+    # Programs with the same gross pay keep the order they were added in.
+    sorted_cols = np.lexsort((program_order, np.where(present, gross, np.iinfo(np.int64).max)), axis=1)
+    sorted_gross = np.take_along_axis(gross, sorted_cols, axis=1)
+    sorted_taxes = np.take_along_axis(taxes, sorted_cols, axis=1)
+    program_counts = present.sum(axis=1)
+
+    sorted_net = np.zeros(shape, dtype=np.int64)
+    deduction_amount_already_applied = np.zeros(len(employees), dtype=np.int64)
+    last_deduction_split = np.zeros(len(employees), dtype=np.int64)
+    for position in range(program_counts.max() if len(employees) else 0):
+        active = position < program_counts
+        programs_left = np.where(active, program_counts - position, 1)
+        # TODO: if I ever map certain deductions to certain programs, this will need to change
+        deductions_split_among_programs = (employee_deductions - deduction_amount_already_applied) // programs_left
+        net_pay_before_deductions = sorted_gross[:, position] - sorted_taxes[:, position]
+        covered = deductions_split_among_programs <= net_pay_before_deductions
+
+        sorted_net[:, position] = np.where(active & covered, net_pay_before_deductions - deductions_split_among_programs, 0)
+        deduction_amount_already_applied = np.where(active, deduction_amount_already_applied + np.where(covered, deductions_split_among_programs, net_pay_before_deductions), deduction_amount_already_applied)
+        last_deduction_split = np.where(position == program_counts - 1, deductions_split_among_programs, last_deduction_split)
+
+    net = np.zeros(shape, dtype=np.int64)
+    np.put_along_axis(net, sorted_cols, sorted_net, axis=1)
+
+    # columns we didn't start with are listed in the order they first show up, smallest program first within an employee
+    sorted_position = np.empty_like(sorted_cols)
+    np.put_along_axis(sorted_position, sorted_cols, np.broadcast_to(np.arange(len(programs)), shape), axis=1)
+    first_rows = present.argmax(axis=0) if len(employees) else np.zeros(len(programs), dtype=int)
+    added_cols = sorted(range(len(tracked_programs), len(programs)), key=lambda col: (first_rows[col], sorted_position[first_rows[col], col]))
+    display_cols = list(range(len(tracked_programs))) + added_cols
+
+    # the last (largest) program couldn't cover what was left of the deductions
+    unapplied = (program_counts > 0) & (deduction_amount_already_applied < employee_deductions)
+    unapplied_deductions = [None] * len(employees)
+    for row in np.flatnonzero(unapplied).tolist():
+        last_col = sorted_cols[row, program_counts[row] - 1]
+        unapplied_deductions[row] = (programs[last_col], gross[row, last_col].item(), last_deduction_split[row].item())
+
+    return ProgramAllocation([programs[col] for col in display_cols], gross[:, display_cols], taxes[:, display_cols], employer_taxes[:, display_cols], net[:, display_cols], unapplied_deductions)
+
+
+def parse_employees(excel_file, messages, profiler=None, parse_workers=None):
+    # Parse a loaded register into an EmployeeTable. Returns the employees, the stated grand total and the FUTA total.
+    # With parse_workers the employee blocks are parsed on that many processes, see parse_register_parallel.
+    # FUTA, CA ETT, Employee Tot: and Grand Tot: rows, shared by every lookup below
+    with profile_stage(profiler, 'parse.marker_index'):
+        marker_index = MarkerIndex(excel_file)
+    # every numeric column converted once, all reads below are list lookups
+    with profile_stage(profiler, 'parse.numeric_columns'):
+        numbers = NumericColumns(excel_file)
+
+    departments_dict = {}
+    employee_blocks = []
+    grand_total = None
+
+    def add_employee_block(block):
+        if block.total.gross_pay > 0:
+            employee_blocks.append(block)
+        else:
+            messages.append(f"\nWarning: {block.name} had no earnings this pay period.")
+
+    if parse_workers:
+        with profile_stage(profiler, 'parse.employee_blocks_parallel'):
+            departments, parsed, grand_total = parse_register_parallel(excel_file, marker_index, numbers, parse_workers, profiler)
+        for department in departments:
+            departments_dict[department.name] = department.row
+        for block, block_messages in parsed:
+            messages.extend(block_messages)
+            if block is not None:
+                add_employee_block(block)
+    else:
+        with profile_stage(profiler, 'parse.employee_scan'):
+            for event in parse_register(excel_file, marker_index, numbers, messages, profiler):
+                if isinstance(event, DepartmentStart):
+                    # BUILD DEFAULT DEPARTMENT LOOKUP DICTIONARY
+                    departments_dict[event.name] = event.row
+                elif isinstance(event, EmployeeBlock):
+                    add_employee_block(event)
+                elif isinstance(event, GrandTotal):
+                    grand_total = event
+
+    with profile_stage(profiler, 'parse.departments'):
+        department_index = DepartmentIndex(departments_dict)
+        default_departments = department_index.find_all([block.last_program_row for block in employee_blocks])
+
+    employees = EmployeeTable.from_blocks(employee_blocks, default_departments)
+    # added up in cents so it comes out exact
+    total_futa = int(employees.employer_futa.sum()) / 100
+    return employees, grand_total, total_futa
+
+
+# PARSE CACHE
+# bump this whenever a parser change would make previously cached records wrong
+parser_version = 2
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'WageDistribution')
+
+
+def file_content_hash(path):
+    # sha256 of a file's bytes, read a megabyte at a time
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as register_file:
+        for chunk in iter(lambda: register_file.read(1024 * 1024), b''):
+            content_hash.update(chunk)
+    return content_hash
+
+
+class ParseCache:
+    # Parsed employees and stated totals on disk, keyed by the register's content hash and the parser version,
+    # so re-running the same export after changing the rules skips loading and parsing the workbook.
+    # Each entry is one .npz file: the EmployeeTable's arrays as they are and the text as a small JSON blob.
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=256 * 1024 * 1024, refresh=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.refresh = refresh  # ignore what is cached and parse again
+
+    def key(self, path, sheet_name='Sheet1', detect_layout=False):
+        # a register read with detected columns can parse differently from one read with the built-in columns
+        content_hash = file_content_hash(path)
+        content_hash.update(f"|{sheet_name}|{parser_version}|{'detected' if detect_layout else 'fixed'}".encode())
+        return content_hash.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key):
+        # (employees, grand_total, total_futa, messages) or None when there is nothing usable cached
+        import numpy as np
+
+        entry_path = self.entry_path(key)
+        if self.refresh or not os.path.exists(entry_path):
+            return None
+        try:
+            with np.load(entry_path) as entry:
+                text = json.loads(entry['text'].tobytes().decode())
+                arrays = {name: entry[name] for name in ['money', 'program_offsets', 'category_codes', 'category_cents']}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile, zlib.error):
+            # a damaged entry is just a miss, another run may have removed it already
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            return None
+        if text['parser_version'] != parser_version:
+            return None
+
+        employees = EmployeeTable(text['ids'], text['names'], text['departments'], arrays['money'], text['categories'], arrays['program_offsets'], arrays['category_codes'], arrays['category_cents'])
+        grand_total = GrandTotal(*text['grand_total']) if text['grand_total'] is not None else None
+        # mark it as recently used, unless it was evicted since
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        return employees, grand_total, text['total_futa'], text['messages']
+
+    def store(self, key, employees, grand_total, total_futa, messages):
+        import numpy as np
+
+        text = {
+            'parser_version': parser_version,
+            'ids': employees.ids,
+            'names': employees.names,
+            'departments': employees.default_departments,
+            'categories': employees.categories,
+            'grand_total': list(grand_total) if grand_total is not None else None,
+            'total_futa': total_futa,
+            'messages': messages,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_path = self.entry_path(key)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as entry_file:
+            np.savez_compressed(entry_file, money=employees.money, program_offsets=employees.program_offsets, category_codes=employees.category_codes,
+                                category_cents=employees.category_cents, text=np.frombuffer(json.dumps(text).encode(), dtype=np.uint8))
+        os.replace(temp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        # drop the least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                entry_path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npz'):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except FileNotFoundError:
+                        pass
+
+
+def map_employee_programs(employees, rules, allocation_messages, resolved_categories=None):
+    # Consolidate every employee's pay categories into programs. Returns one {program: gross pay in cents} dict per employee.
+    # Every category that is looked up is added to resolved_categories when a set is passed, for --profile.
+    mapped_program_gross = []
+
+    for row, (employee_id, employee_name, default_department, program_cents) in enumerate(zip(employees.ids, employees.names, employees.default_departments, employees.iter_program_cents())):
+        employee_mapped_program_gross = {}
+
+        # There are a select few people that need to be excluded or split between programs, they are listed in the rules file.
+        # What is left of their pay is mapped like everyone else's.
+        split_amounts = {}
+        if employee_id in rules.special_cases:
+            program_cents, default_department, split_amounts = rules.apply_special_case(employee_id, program_cents, default_department)
+
+        #current problem is that program gross pay is reassigned correctly, but taxes are just shifted to the person's default program
+
+        # Manage hours for special case employees will be split between main programs
+        for split_program in rules.split_programs:
+            employee_mapped_program_gross[split_program] = split_amounts.get(split_program, 0)
+        for split_program, split_amount in split_amounts.items():
+            if split_program not in employee_mapped_program_gross:
+                employee_mapped_program_gross[split_program] = split_amount
+
+        if resolved_categories is not None:
+            resolved_categories.update(program_cents)
+
+        # Loop over all employee programs that the employee had pay in
+        for employee_program, employee_program_gross in program_cents.items():
+            adjusted_program = rules.resolve(employee_program)
+            if adjusted_program is map_to_default_department:
+                # Many categories like "Mentor" need to be adjusted into their default program
+                adjusted_program = default_department
+            elif adjusted_program is None:
+                adjusted_program = employee_program
+                allocation_messages.setdefault(row, []).append(f"Unhandled program! {employee_name}: {employee_program}")
+
+            # GROSS pay
+            if adjusted_program in employee_mapped_program_gross:
+                employee_mapped_program_gross[adjusted_program] += employee_program_gross
+            else:
+                employee_mapped_program_gross[adjusted_program] = employee_program_gross
+
+        mapped_program_gross.append(employee_mapped_program_gross)
+
+    return mapped_program_gross
+
+
+# the totals we reconcile, both as stated by the register and as calculated from the employees, in cents
+PayrollTotals = namedtuple('PayrollTotals', ['gross', 'net', 'deductions', 'employee_taxes', 'employer_taxes_minus_futa', 'employer_futa', 'ca_ett', 'total_taxes'])
+
+# every total but CA ETT, which is taken from the register on both sides
+reconciled_totals = [name for name in PayrollTotals._fields if name != 'ca_ett']
+
+
+def optional_cents(dollars):
+    return None if dollars is None else int(to_cents(dollars))
+
+
+def reconcile(calculated, stated):
+    # One vectorized comparison of every reconciled total. Returns a bool array in reconciled_totals order,
+    # a total only passes when both sides are known and equal to the cent.
+    import numpy as np
+
+    pairs = [(getattr(calculated, name), getattr(stated, name)) for name in reconciled_totals]
+    known = np.array([calculated_cents is not None and stated_cents is not None for calculated_cents, stated_cents in pairs])
+    calculated_cents = np.array([calculated_cents or 0 for calculated_cents, _ in pairs], dtype=np.int64)
+    stated_cents = np.array([stated_cents or 0 for _, stated_cents in pairs], dtype=np.int64)
+    return known & (calculated_cents == stated_cents)
+
+
+class PayrollResult:
+    # Everything process_payroll works out for one register.
+    def __init__(self, input_file, employees, grand_total, allocation, stated, calculated, messages):
+        self.input_file = input_file
+        self.employees = employees
+        self.grand_total = grand_total
+        self.allocation = allocation
+        self.gross_by_program = allocation.by_program(allocation.gross)
+        self.tax_by_program = allocation.by_program(allocation.taxes)
+        self.employer_taxes_by_program = allocation.by_program(allocation.employer_taxes)
+        self.net_by_program = allocation.by_program(allocation.net)
+        self.stated = stated
+        self.calculated = calculated
+        self.messages = messages  # errors and warnings, in the order they came up
+        self.load_engine = None
+        self.load_seconds = None
+
+    def reconciliation(self):
+        # (name, calculated, stated) in dollars for every total we check
+        return [(name, None if getattr(self.calculated, name) is None else getattr(self.calculated, name) / 100, None if getattr(self.stated, name) is None else getattr(self.stated, name) / 100)
+                for name in reconciled_totals]
+
+    def mismatches(self):
+        # names of the totals where calculated and stated don't agree to the cent
+        return [name for name, matches in zip(reconciled_totals, reconcile(self.calculated, self.stated).tolist()) if not matches]
+
+    def reconciles(self):
+        # the hard pass or fail: every total agrees to the cent
+        return bool(reconcile(self.calculated, self.stated).all())
+
+
+def allocate_payroll(employees, grand_total, total_futa, rules, messages, profiler=None):
+    # Split every employee's pay over the tracked programs and total everything up. Returns a PayrollResult without load details.
+    import numpy as np
+
+    # used to verify all money is accounted for and there are no rounding errors.
+    employee_gross_pay = employees.gross_pay
+    employee_taxes = employees.employee_taxes
+    employee_deductions = employees.deductions
+    calculated_gross_total = int(employee_gross_pay.sum())
+    # but for now, just get the total deduction per employee
+    calculated_deductions = int(employee_deductions.sum())
+
+    # messages for each employee, added in employee order once the allocation is done
+    allocation_messages = {}
+
+    # Edge case here where there is more deductions than earnings. Flag it so we can handle it if it pops up
+    for row in np.flatnonzero(employee_deductions > employee_gross_pay - employee_taxes).tolist():
+        employee = employees[row]
+        allocation_messages.setdefault(row, []).append(f"ERROR: {employee.name} has more deductions ({format_dollars(employee_deductions[row])}) than available net pay ({format_dollars(employee_gross_pay[row] - employee_taxes[row])}). This is very weird and will need special handling.")
+
+    # will contain the consolidated list of programs instead of ALL pay categories, one dict per employee
+    with profile_stage(profiler, 'allocate.category_mapping'):
+        resolved_categories = set() if profiler is not None else None
+        mapped_program_gross = map_employee_programs(employees, rules, allocation_messages, resolved_categories)
+
+    # taxes, employer taxes and net pay for every employee and program at once
+    with profile_stage(profiler, 'allocate.program_matrix'):
+        allocation = allocate_programs(employees, mapped_program_gross, rules.tracked_programs)
+    if profiler is not None:
+        profiler.count('distinct_categories', len(resolved_categories))
+
+    for row, unapplied_deduction in enumerate(allocation.unapplied_deductions):
+        if unapplied_deduction is not None:
+            adjusted_program, employee_program_gross, deductions_split_among_programs = unapplied_deduction
+            allocation_messages.setdefault(row, []).append(f"ERROR: Unable to apply all deductions because the last category ({adjusted_program}) didn't have enough money in it to cover the distribution.")
+            allocation_messages[row].append(f"\tBecause we sort the dict by program gross earnings, this case should now only occur when deductions are more than net earnings.")
+            allocation_messages[row].append(f"\tAmount in last program {adjusted_program}: {format_dollars(employee_program_gross)} | still left to deduct: {format_dollars(deductions_split_among_programs)}")
+
+    for row in sorted(allocation_messages):
+        messages.extend(allocation_messages[row])
+
+    stated = PayrollTotals(None, None, None, None, None, None, None, None)
+    if grand_total is not None:
+        stated_taxes = optional_cents(grand_total.taxes)
+        stated_employer_taxes = optional_cents(grand_total.employer_taxes)
+        stated_futa = optional_cents(grand_total.employer_futa)
+        stated_ca_ett = optional_cents(grand_total.ca_ett)
+        # we subtract out FUTA here because it is billed separately
+        stated_employer_taxes_minus_futa = stated_employer_taxes - stated_futa if None not in (stated_employer_taxes, stated_futa) else None
+        stated_total_taxes = stated_taxes + stated_employer_taxes_minus_futa + stated_ca_ett if None not in (stated_taxes, stated_employer_taxes_minus_futa, stated_ca_ett) else None
+        stated = PayrollTotals(optional_cents(grand_total.gross_pay), optional_cents(grand_total.net_pay), optional_cents(grand_total.deductions), stated_taxes, stated_employer_taxes_minus_futa, stated_futa, stated_ca_ett,
+                               stated_total_taxes)
+
+    result = PayrollResult(None, employees, grand_total, allocation, stated, None, messages)
+
+    # only programs with something in them count towards the calculated totals
+    program_taxes = allocation.taxes.sum(axis=0)
+    program_employer_taxes = allocation.employer_taxes.sum(axis=0)
+    program_net = allocation.net.sum(axis=0)
+    taxed_programs = program_taxes + program_employer_taxes > 0
+    calculated_employee_taxes = int(program_taxes[taxed_programs].sum())
+    calculated_employer_taxes_minus_futa = int(program_employer_taxes[taxed_programs].sum())
+    tax_per_program_sum = calculated_employee_taxes + calculated_employer_taxes_minus_futa
+    total_direct_deposited = int(program_net[program_net > 0].sum())
+
+    result.calculated = PayrollTotals(calculated_gross_total, total_direct_deposited, calculated_deductions, calculated_employee_taxes, calculated_employer_taxes_minus_futa, optional_cents(total_futa), stated.ca_ett,
+                                      tax_per_program_sum + stated.ca_ett if stated.ca_ett is not None else None)
+    return result
+
+
+# a register read and parsed, before any rules are applied
+ParsedRegister = namedtuple('ParsedRegister', ['employees', 'grand_total', 'total_futa', 'messages', 'load_engine', 'load_seconds'])
+
+
+def read_payroll(path, engine='auto', sheet_name='Sheet1', cache=None, profiler=None, parse_workers=None, layouts=None):
+    # Load and parse one payroll register into a ParsedRegister.
+    # With a ParseCache, a register that was parsed before skips loading and parsing.
+    # With a LayoutCache, the register's columns are detected instead of taken from the constants at the top.
+    load_start = time.perf_counter()
+    parsed = None
+    if cache is not None:
+        with profile_stage(profiler, 'cache_lookup'):
+            cache_key = cache.key(path, sheet_name, layouts is not None)
+            parsed = cache.load(cache_key)
+
+    if parsed is not None:
+        employees, grand_total, total_futa, messages = parsed
+        return ParsedRegister(employees, grand_total, total_futa, messages, 'cache', time.perf_counter() - load_start)
+
+    with profile_stage(profiler, 'load'):
+        excel_file, load_engine = load_register(path, sheet_name=sheet_name, engine=engine, layouts=layouts)
+    load_seconds = time.perf_counter() - load_start
+
+    messages = []
+    if excel_file.attrs.get('layout_note'):
+        messages.append(excel_file.attrs['layout_note'])
+    with profile_stage(profiler, 'parse'):
+        employees, grand_total, total_futa = parse_employees(excel_file, messages, profiler, parse_workers)
+    if cache is not None:
+        with profile_stage(profiler, 'cache_store'):
+            cache.store(cache_key, employees, grand_total, total_futa, messages)
+    return ParsedRegister(employees, grand_total, total_futa, messages, load_engine, load_seconds)
+
+
+def process_payroll(path, rules=None, engine='auto', sheet_name='Sheet1', cache=None, profiler=None, parse_workers=None, layouts=None):
+    # Load, parse and allocate one payroll register. rules is an AllocationRules, a path to a rules file, or None for the default.
+    if not isinstance(rules, AllocationRules):
+        rules = AllocationRules.load(rules or default_rules_file)
+
+    parsed = read_payroll(path, engine, sheet_name, cache, profiler, parse_workers, layouts)
+    with profile_stage(profiler, 'allocate'):
+        result = allocate_payroll(parsed.employees, parsed.grand_total, parsed.total_futa, rules, list(parsed.messages), profiler)
+    result.input_file = path
+    result.load_engine = parsed.load_engine
+    result.load_seconds = parsed.load_seconds
+    return result
+
+
+def print_report(result):
+    stated = result.stated
+    calculated = result.calculated
+    allocation = result.allocation
+    tax_by_program = allocation.program_cents(allocation.taxes)
+    employer_taxes_by_program = allocation.program_cents(allocation.employer_taxes)
+
+    # print(f"\n\nGROSS: Every pay category with non-zero pay:\n")
+    # for program, gross in result.gross_by_program.items():
+    #     print(f"\t{program}: {round(gross, 2)}")
+
+    print(f"\n\nNote: There are 2 withdrawals for taxes, a large one and a small one.\nThe small one is the total FUTA (${format_dollars(calculated.employer_futa)}) taxes (Federal unemployment tax).\nThe larger one consists of: (employee_taxes + employer_taxes - FUTA + CA_ETT)\nHowever, since we take out the FUTA charge per employee, we don't do it here.")
+
+    print(f"\nTAX: Every pay category with non-zero pay:\n")
+    print(f"\tAdmin: \t\t{format_dollars(stated.ca_ett)} (CA ETT)")
+
+    for program, tax in tax_by_program.items():
+        combined_taxes = tax + employer_taxes_by_program[program]
+        if combined_taxes > 0:
+            spaces = "\t" if len(program) >= 6 else "\t\t"
+            print(f"\t{program}: {spaces}{format_dollars(tax)}   \t+ {format_dollars(employer_taxes_by_program[program])}   \t= {format_dollars(combined_taxes)}")
+
+    print(f"\n\n\tCalculated Total Taxes: \t\t{format_dollars(calculated.total_taxes)}")
+    print(f"\tIt should equal (stated values): \t{format_dollars(stated.total_taxes)}\n")
+
+    print(f"\tCalculated Employee Taxes: \t\t{format_dollars(calculated.employee_taxes)}\t(All employee taxes added together)")
+    print(f"\tStated Employee Taxes: \t\t\t{format_dollars(stated.employee_taxes)}\n")
+
+    print(f"\tCalculated Employer Taxes: \t\t{format_dollars(calculated.employer_taxes_minus_futa)}\t(All employer taxes per employee minus FUTA added together)")
+    print(f"\tStated Employer Taxes: \t\t\t{format_dollars(stated.employer_taxes_minus_futa)}\n")
+
+    print(f"\tCalculated Employer FUTA: \t\t{format_dollars(calculated.employer_futa)} \t(All employee FUTA values added together)")
+    print(f"\tStated Employer FUTA: \t\t\t{format_dollars(stated.employer_futa)}\n")
+
+    print(f"\n\temployee_taxes + employer_taxes + CA_ETT = Amount Taken From Bank Account")
+    print(f"\t{format_dollars(calculated.employee_taxes)} + {format_dollars(calculated.employer_taxes_minus_futa)} + {format_dollars(stated.ca_ett)} = {format_dollars(calculated.total_taxes)}")
+
+    print(f"\nNET: Every pay category with non-zero pay:\n")
+    for program, net in allocation.program_cents(allocation.net).items():
+        if net > 0:
+            print(f"\t{program}: {format_dollars(net)}")
+
+    print(f"\n\tCALCULATED NET: \t\t{format_dollars(calculated.net)}")
+    print(f"\tSTATED NET: \t\t\t{format_dollars(stated.net)}")
+
+    print(f"\n\tCALCULATED DEDUCTIONS: \t\t{format_dollars(calculated.deductions)}")
+    print(f"\tSTATED DEDUCTIONS: \t\t{format_dollars(stated.deductions)}\n")
+
+    print(f"\tCOMBINED CALCULATED: \t\t{format_dollars(calculated.deductions + calculated.employee_taxes + calculated.net)}\n")
+
+    print(f"\tCALCULATED GROSS: \t\t{format_dollars(calculated.gross)}")
+    print(f"\tSTATED GROSS: \t\t\t{format_dollars(stated.gross)}\n")
+
+    if result.reconciles():
+        print(f"\tRECONCILIATION: PASS, every total matches to the cent\n")
+    else:
+        print(f"\tRECONCILIATION: FAIL, mismatched: {', '.join(result.mismatches())}\n")
+
+
+# WHAT-IF SCENARIOS: the same parsed register allocated under different rules, compared program by program.
+# A scenarios file lists {"name": ..., "rules": {...}} entries. Each "rules" replaces those keys of the rules file,
+# except special_case_employees and category_programs which are merged entry by entry (null removes an entry).
+merged_rule_keys = ('special_case_employees', 'category_programs')
+
+
+def scenario_rules_config(base_config, overrides):
+    config = dict(base_config)
+    for key, value in overrides.items():
+        if key in merged_rule_keys:
+            merged = dict(config.get(key, {}))
+            for name, entry in value.items():
+                if entry is None:
+                    merged.pop(name, None)
+                else:
+                    merged[name] = entry
+            config[key] = merged
+        else:
+            config[key] = value
+    return config
+
+
+def load_scenarios(path, rules):
+    # [(name, AllocationRules)] in file order. Raises ValueError when the file is not a list of named scenarios.
+    with open(path) as scenarios_file:
+        config = json.load(scenarios_file)
+    scenarios = []
+    for scenario in config.get('scenarios', []) if isinstance(config, dict) else config:
+        if not isinstance(scenario, dict) or 'name' not in scenario or not isinstance(scenario.get('rules', {}), dict):
+            raise ValueError(f"every scenario needs a name and a rules object, got {scenario!r}")
+        scenarios.append((scenario['name'], AllocationRules(scenario_rules_config(rules.config, scenario.get('rules', {})))))
+    if not scenarios:
+        raise ValueError("no scenarios listed")
+    if len({name for name, _ in scenarios}) != len(scenarios):
+        raise ValueError("scenario names must be unique")
+    return scenarios
+
+
+def evaluate_scenarios(parsed, rules, scenarios):
+    # Allocate a ParsedRegister under the baseline rules and every (name, AllocationRules) scenario. Every allocation is one
+    # vectorized pass over all employees, the workbook is never read again. Returns the baseline and {name: PayrollResult}.
+    baseline = allocate_payroll(parsed.employees, parsed.grand_total, parsed.total_futa, rules, list(parsed.messages))
+    results = {}
+    for name, scenario_rules in scenarios:
+        results[name] = allocate_payroll(parsed.employees, parsed.grand_total, parsed.total_futa, scenario_rules, list(parsed.messages))
+    return baseline, results
+
+
+def scenario_delta_table(baseline, result):
+    # per program: baseline gross, scenario gross and the change in every amount. Programs only one side has count as 0 on the other.
+    import pandas as pd
+
+    baseline_amounts = pd.DataFrame(result_by_program(baseline))
+    scenario_amounts = pd.DataFrame(result_by_program(result))
+    programs = list(baseline_amounts.index) + [program for program in scenario_amounts.index if program not in baseline_amounts.index]
+    baseline_amounts = baseline_amounts.reindex(programs, fill_value=0)
+    scenario_amounts = scenario_amounts.reindex(programs, fill_value=0)
+    deltas = scenario_amounts[allocation_measures] - baseline_amounts[allocation_measures]
+    table = pd.DataFrame({'baseline_gross': baseline_amounts['gross'], 'scenario_gross': scenario_amounts['gross']})
+    for measure in allocation_measures:
+        table[f"{measure}_delta"] = deltas[measure]
+    table.index.name = 'program'
+    return table
+
+
+def print_scenario_report(baseline, results):
+    for name, result in results.items():
+        print(f"\nSCENARIO: {name}\n")
+        # anything the scenario's rules complain about that the baseline didn't
+        baseline_messages = set(baseline.messages)
+        for message in result.messages:
+            if message not in baseline_messages:
+                print(message)
+
+        table = scenario_delta_table(baseline, result)
+        changed = table[(table[[f"{measure}_delta" for measure in allocation_measures]].round(2) != 0).any(axis=1)].copy()
+        if len(changed) == 0:
+            print("\tNo change.")
+            continue
+        # totals of the programs that changed. adding 0.0 turns -0.0 into 0.0
+        changed.loc['TOTAL'] = changed.sum()
+        print((changed.round(2) + 0.0).to_string())
+
+
+# BATCH MODE: a whole folder of pay periods at once, one worker process per file
+register_extensions = ('.xls', '.xlsx', '.xlsm')
+
+# what a worker sends back for each file. by_program maps gross/employee_taxes/employer_taxes/net to {program: amount},
+# employee_allocations is only filled in when the batch is being recorded in a PayrollStore
+BatchEntry = namedtuple('BatchEntry', ['input_file', 'period', 'status', 'by_program', 'reconciliation', 'messages', 'employee_allocations', 'employees'])
+
+
+def find_registers(pattern):
+    # every register in a directory, or every file matching a glob
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if os.path.splitext(path)[1].lower() in register_extensions and not os.path.basename(path).startswith('~$'))
+
+
+def result_status(result):
+    # 'ok', or what is wrong with the register
+    if result.grand_total is None:
+        return 'failed: no "Grand Tot:" row found'
+    if result.mismatches():
+        return 'mismatch: ' + ', '.join(result.mismatches())
+    return 'ok'
+
+
+def result_by_program(result):
+    return {
+        'gross': result.gross_by_program,
+        'employee_taxes': result.tax_by_program,
+        'employer_taxes': result.employer_taxes_by_program,
+        'net': result.net_by_program,
+    }
+
+
+def process_batch_file(path, rules_path, engine='auto', cache=None, with_employees=False, layouts=None):
+    # Runs in a worker process. Never raises, a file that can't be processed is reported in its status instead.
+    period = os.path.splitext(os.path.basename(path))[0]
+    try:
+        result = process_payroll(path, rules_path, engine=engine, cache=cache, layouts=layouts)
+    except Exception as e:
+        return BatchEntry(path, period, f"failed: {type(e).__name__}: {e}", {}, [], [], [], [])
+
+    employee_allocations = list(employee_allocation_rows(result)) if with_employees else []
+    employees = employee_rows(result) if with_employees else []
+    return BatchEntry(path, period, result_status(result), result_by_program(result), result.reconciliation(), result.messages, employee_allocations, employees)
+
+
+def run_batch(paths, rules_path, engine='auto', workers=None, cache=None, with_employees=False, on_entry=None, executor=None, layouts=None):
+    # Process every register on a process pool. Entries come back in the same order as paths.
+    # on_entry is called with each entry in that order, as soon as it and every one before it are done, and what it
+    # returns is kept instead. That lets the per-employee rows be written out and dropped while the batch runs.
+    # Pass an executor to reuse its (already warm) workers, otherwise a pool is started and shut down for this batch.
+    entries = {}
+    next_path = 0
+    with nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_batch_file, path, rules_path, engine, cache, with_employees, layouts): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                entries[path] = future.result()
+            except Exception as e:
+                # the worker itself died
+                entries[path] = BatchEntry(path, os.path.splitext(os.path.basename(path))[0], f"failed: {type(e).__name__}: {e}", {}, [], [], [], [])
+            while on_entry is not None and next_path < len(paths) and paths[next_path] in entries:
+                entries[paths[next_path]] = on_entry(entries[paths[next_path]])
+                next_path += 1
+    return [entries[path] for path in paths]
+
+
+def save_batch_entry(entry, output=None, store=None):
+    # Write a processed register to output and record it in store, either can be None. Failed registers are neither.
+    # Returns the pay date it was recorded under, or None when it wasn't recorded.
+    if entry.status.startswith('failed'):
+        return None
+    if output is not None:
+        output.write(entry.period, entry.by_program, entry.reconciliation, entry.employee_allocations)
+    if store is None:
+        return None
+    pay_date = pay_date_from_name(entry.period)
+    if pay_date is not None:
+        store.record(entry.period, pay_date, entry.input_file, entry.status, entry.by_program, entry.employee_allocations, entry.employees)
+    return pay_date
+
+
+def batch_program_table(entries):
+    # One row per pay period and program
+    import pandas as pd
+
+    records = []
+    for entry in entries:
+        programs = entry.by_program.get('gross', {})
+        for program in programs:
+            records.append({
+                'period': entry.period,
+                'program': program,
+                'gross': programs[program],
+                'employee_taxes': entry.by_program['employee_taxes'][program],
+                'employer_taxes': entry.by_program['employer_taxes'][program],
+                'net': entry.by_program['net'][program],
+            })
+    return pd.DataFrame(records, columns=['period', 'program', 'gross', 'employee_taxes', 'employer_taxes', 'net'])
+
+
+def print_batch_report(entries):
+    table = batch_program_table(entries)
+    for measure in ['gross', 'employee_taxes', 'employer_taxes', 'net']:
+        if len(table):
+            per_period = table.pivot_table(index='period', columns='program', values=measure, aggfunc='sum', fill_value=0, sort=False).round(2)
+            print(f"\n{measure.upper()} by period and program:\n")
+            print(per_period.to_string())
+
+    print(f"\nRECONCILIATION:\n")
+    for entry in entries:
+        print(f"\t{entry.period}: \t{entry.status}")
+
+
+# YEAR TO DATE STORE: every recorded pay period in one SQLite file, so quarterly and annual numbers
+# come from the store instead of re-reading every register. See PayrollHistory.py for the roll-ups.
+default_store_file = os.path.join(os.path.expanduser('~'), '.local', 'share', 'WageDistribution', 'payroll.sqlite')
+
+# the amounts stored for every program, per period and per employee
+allocation_measures = ['gross', 'employee_taxes', 'employer_taxes', 'net']
+
+# pay dates we recognize in a register's file name: 2024-03-15, 20240315 or 03-15-2024, with - _ or . between the parts
+pay_date_patterns = [
+    (re.compile(r'(?<!\d)(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})(?!\d)'), ('year', 'month', 'day')),
+    (re.compile(r'(?<!\d)(\d{1,2})[-_.](\d{1,2})[-_.](\d{4})(?!\d)'), ('month', 'day', 'year')),
+]
+
+
+def pay_date_from_name(name):
+    # the first valid date in a file name as YYYY-MM-DD, or None
+    from datetime import date
+
+    for pattern, parts in pay_date_patterns:
+        for match in pattern.finditer(name):
+            values = dict(zip(parts, map(int, match.groups())))
+            try:
+                return date(values['year'], values['month'], values['day']).isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+def employee_allocation_rows(result):
+    # (employee number, name, program, gross, employee taxes, employer taxes, net) for every program an employee was paid from
+    import numpy as np
+
+    allocation = result.allocation
+    rows, cols = np.nonzero((allocation.gross != 0) | (allocation.net != 0))
+    measures = [(allocation.gross[rows, cols] / 100).tolist(), (allocation.taxes[rows, cols] / 100).tolist(), (allocation.employer_taxes[rows, cols] / 100).tolist(), (allocation.net[rows, cols] / 100).tolist()]
+    ids = result.employees.ids
+    names = result.employees.names
+    programs = allocation.programs
+    for i, (row, col) in enumerate(zip(rows.tolist(), cols.tolist())):
+        yield (ids[row], names[row], programs[col], measures[0][i], measures[1][i], measures[2][i], measures[3][i])
+
+
+def employee_rows(result):
+    # (employee number, name, default department) for every employee
+    employees = result.employees
+    return list(zip(employees.ids, employees.names, employees.default_departments))
+
+
+class PayrollStore:
+    # Recording a period replaces whatever was stored for it before, so re-running a register never counts it twice.
+    # Periods are keyed by name, the register's file name unless one is given.
+    schema = """
+        CREATE TABLE IF NOT EXISTS periods (
+            period TEXT PRIMARY KEY,
+            pay_date TEXT,
+            input_file TEXT,
+            status TEXT,
+            recorded_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS program_totals (
+            period TEXT NOT NULL,
+            program TEXT NOT NULL,
+            gross REAL, employee_taxes REAL, employer_taxes REAL, net REAL,
+            PRIMARY KEY (period, program)
+        );
+        CREATE TABLE IF NOT EXISTS employee_allocations (
+            period TEXT NOT NULL,
+            employee_number TEXT,
+            employee_name TEXT,
+            program TEXT NOT NULL,
+            gross REAL, employee_taxes REAL, employer_taxes REAL, net REAL
+        );
+        CREATE TABLE IF NOT EXISTS employees (
+            period TEXT NOT NULL,
+            employee_number TEXT,
+            employee_name TEXT,
+            default_department TEXT
+        );
+        CREATE INDEX IF NOT EXISTS employee_allocations_period ON employee_allocations (period);
+        CREATE INDEX IF NOT EXISTS employees_period ON employees (period);
+        CREATE INDEX IF NOT EXISTS periods_pay_date ON periods (pay_date);
+    """
+
+    # what rollup can group by, as (SQL expression, column name) pairs
+    group_columns = {
+        'year': [("substr(periods.pay_date, 1, 4)", 'year')],
+        'quarter': [("(CAST(substr(periods.pay_date, 6, 2) AS INTEGER) + 2) / 3", 'quarter')],
+        'period': [("periods.pay_date", 'pay_date'), ("periods.period", 'period')],
+        'program': [("amounts.program", 'program')],
+        'employee': [("amounts.employee_number", 'employee_number'), ("amounts.employee_name", 'employee_name')],
+    }
+
+    def __init__(self, path=default_store_file):
+        self.path = path
+
+    def connect(self):
+        import sqlite3
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.executescript(self.schema)
+        return connection
+
+    def record(self, period, pay_date, input_file, status, by_program, employee_allocations, employees=()):
+        # by_program, employee_allocations and employees as built by result_by_program, employee_allocation_rows and employee_rows
+        from datetime import datetime
+
+        program_rows = [(period, program) + tuple(by_program[measure][program] for measure in allocation_measures) for program in by_program.get('gross', {})]
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM employee_allocations WHERE period = ?", (period,))
+                connection.execute("DELETE FROM program_totals WHERE period = ?", (period,))
+                connection.execute("DELETE FROM employees WHERE period = ?", (period,))
+                connection.execute("INSERT OR REPLACE INTO periods VALUES (?, ?, ?, ?, ?)", (period, pay_date, os.path.abspath(input_file), status, datetime.now().isoformat(timespec='seconds')))
+                connection.executemany("INSERT INTO program_totals VALUES (?, ?, ?, ?, ?, ?)", program_rows)
+                connection.executemany("INSERT INTO employee_allocations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", ((period,) + row for row in employee_allocations))
+                connection.executemany("INSERT INTO employees VALUES (?, ?, ?, ?)", ((period,) + tuple(row) for row in employees))
+        finally:
+            connection.close()
+
+    def record_result(self, period, pay_date, result):
+        self.record(period, pay_date, result.input_file, result_status(result), result_by_program(result), employee_allocation_rows(result), employee_rows(result))
+
+    def periods(self):
+        # DataFrame of every recorded period, by pay date
+        import pandas as pd
+
+        connection = self.connect()
+        try:
+            return pd.read_sql_query("SELECT * FROM periods ORDER BY pay_date, period", connection)
+        finally:
+            connection.close()
+
+    def period_rows(self, periods):
+        # (allocations, employees) DataFrames of the given periods, as period_diff takes them. Periods recorded before
+        # default departments were stored have no employees rows.
+        import pandas as pd
+
+        connection = self.connect()
+        try:
+            selected = "period IN (SELECT value FROM json_each(?))"
+            allocations = pd.read_sql_query(f"SELECT period, employee_number, employee_name, program, {', '.join(allocation_measures)} FROM employee_allocations WHERE {selected}",
+                                            connection, params=[json.dumps(list(periods))])
+            employees = pd.read_sql_query(f"SELECT period, employee_number, employee_name, default_department FROM employees WHERE {selected}", connection, params=[json.dumps(list(periods))])
+            return allocations, employees
+        finally:
+            connection.close()
+
+    def rollup(self, group_by, year=None, quarter=None, through=None):
+        # DataFrame with the sum of every measure, grouped by any of group_columns. year, quarter and through
+        # (a YYYY-MM-DD pay date, inclusive) only keep the periods paid then. Periods without a pay date only
+        # show up when none of those are given.
+        import pandas as pd
+
+        table = 'employee_allocations' if 'employee' in group_by else 'program_totals'
+        columns = [column for group in group_by for column in self.group_columns[group]]
+        conditions = []
+        parameters = []
+        if year is not None:
+            conditions.append(f"{self.group_columns['year'][0][0]} = ?")
+            parameters.append(f"{int(year):04d}")
+        if quarter is not None:
+            conditions.append(f"{self.group_columns['quarter'][0][0]} = ?")
+            parameters.append(int(quarter))
+        if through is not None:
+            conditions.append("periods.pay_date <= ?")
+            parameters.append(through)
+
+        selected = [f"{expression} AS {name}" for expression, name in columns] + [f"SUM(amounts.{measure}) AS {measure}" for measure in allocation_measures]
+        query = f"SELECT {', '.join(selected)} FROM {table} AS amounts JOIN periods ON periods.period = amounts.period"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if columns:
+            # programs stay in the order they were first recorded, like the per-period report
+            order = ['MIN(amounts.rowid)' if name == 'program' else expression for expression, name in columns if name != 'employee_name']
+            query += f" GROUP BY {', '.join(expression for expression, _ in columns)} ORDER BY {', '.join(order)}"
+
+        connection = self.connect()
+        try:
+            return pd.read_sql_query(query, connection, params=parameters)
+        finally:
+            connection.close()
+
+
+# PERIOD DIFF: what changed from one pay period to the next, per employee and per program, for reviewing anomalies.
+# Periods are compared with hash joins on (comparison, employee number, program), so comparing every pair of
+# consecutive periods in years of history is a handful of merges, not a loop over employees.
+diff_keys = ['previous_period', 'period']
+diff_measures = ['gross', 'net']
+default_min_change = 50.0       # dollars
+default_min_change_pct = 25.0   # percent of the previous amount
+
+
+def result_frames(period, result):
+    # (allocations, employees) DataFrames of one PayrollResult, the same as PayrollStore.period_rows gives for a recorded period
+    import numpy as np
+    import pandas as pd
+
+    allocation = result.allocation
+    rows, cols = np.nonzero((allocation.gross != 0) | (allocation.net != 0))
+    ids = np.array(result.employees.ids, dtype=object)
+    names = np.array(result.employees.names, dtype=object)
+    allocations = pd.DataFrame({
+        'period': period,
+        'employee_number': ids[rows],
+        'employee_name': names[rows],
+        'program': np.array(allocation.programs, dtype=object)[cols],
+        **{measure: values[rows, cols] / 100 for measure, values in zip(allocation_measures, [allocation.gross, allocation.taxes, allocation.employer_taxes, allocation.net])},
+    })
+    employees = pd.DataFrame({'period': period, 'employee_number': ids, 'employee_name': names, 'default_department': np.array(result.employees.default_departments, dtype=object)})
+    return allocations, employees
+
+
+def period_diff(allocations, employees, pairs, min_change=default_min_change, min_change_pct=default_min_change_pct):
+    # Compare every (previous period, period) in pairs. allocations has a row per period, employee and program, employees
+    # a row per period and employee (without any, default departments aren't compared). Returns two DataFrames of only
+    # what changed, in pairs order:
+    #   employee_changes: new and terminated employees and changed default departments, with their gross and net pay
+    #   program_changes: for employees paid in both periods, programs that appeared or vanished and changed amounts.
+    #     flagged when gross or net moved by at least min_change dollars and min_change_pct percent, largest changes first.
+    import numpy as np
+    import pandas as pd
+
+    pair_frame = pd.DataFrame(pairs, columns=diff_keys)
+    pair_frame['comparison'] = np.arange(len(pair_frame))
+    employee_keys = ['comparison'] + diff_keys + ['employee_number']
+
+    def sides(frame):
+        # the rows of frame as the before and the after side of every comparison they are part of
+        return frame.rename(columns={'period': 'previous_period'}).merge(pair_frame, on='previous_period'), frame.merge(pair_frame, on='period')
+
+    # one row per period, employee and program, even if the same employee number shows up twice
+    allocations = allocations.groupby(['period', 'employee_number', 'program'], sort=False, dropna=False).agg(employee_name=('employee_name', 'first'), **{measure: (measure, 'sum') for measure in diff_measures}).reset_index()
+    before, after = sides(allocations)
+    programs = before.merge(after, on=employee_keys + ['program'], how='outer', suffixes=('_before', '_after'), indicator=True)
+    programs['employee_name'] = programs['employee_name_after'].fillna(programs['employee_name_before'])
+    for measure in diff_measures:
+        programs[f'{measure}_before'] = programs[f'{measure}_before'].fillna(0.0)
+        programs[f'{measure}_after'] = programs[f'{measure}_after'].fillna(0.0)
+        programs[f'{measure}_delta'] = (programs[f'{measure}_after'] - programs[f'{measure}_before']).round(2)
+    programs['in_before'] = programs['_merge'] != 'right_only'
+    programs['in_after'] = programs['_merge'] != 'left_only'
+
+    # EMPLOYEES: paid in only one of the periods, or moved to another default department
+    aggregations = {'employee_name': ('employee_name', 'first'), 'in_before': ('in_before', 'any'), 'in_after': ('in_after', 'any')}
+    aggregations.update({f'{measure}_{side}': (f'{measure}_{side}', 'sum') for measure in diff_measures for side in ['before', 'after']})
+    people = programs.groupby(employee_keys, sort=False, dropna=False).agg(**aggregations).reset_index()
+    departments_before, departments_after = sides(employees[['period', 'employee_number', 'default_department']].drop_duplicates(['period', 'employee_number']).rename(columns={'default_department': 'department'}))
+    departments = departments_before.merge(departments_after, on=employee_keys, how='outer', suffixes=('_before', '_after'))
+    people = people.merge(departments, on=employee_keys, how='left')
+    department_changed = people['department_before'].notna() & people['department_after'].notna() & (people['department_before'] != people['department_after'])
+    people['change'] = np.select([~people['in_before'], ~people['in_after'], department_changed], ['new employee', 'terminated', 'department changed'], '')
+    employee_changes = people[people['change'] != ''].sort_values(['comparison', 'change', 'employee_name'], kind='stable')
+    employee_changes = employee_changes[employee_keys[1:] + ['employee_name', 'change', 'department_before', 'department_after'] + [f'{measure}_{side}' for measure in diff_measures for side in ['before', 'after']]]
+
+    # PROGRAMS: only for employees in both periods, the employee changes above already cover the rest
+    programs = programs.merge(people.loc[people['in_before'] & people['in_after'], employee_keys], on=employee_keys)
+    changed = np.zeros(len(programs), dtype=bool)
+    flagged = np.zeros(len(programs), dtype=bool)
+    for measure in diff_measures:
+        delta = programs[f'{measure}_delta'].to_numpy()
+        previous = programs[f'{measure}_before'].abs().to_numpy()
+        percent = np.divide(np.abs(delta) * 100, previous, out=np.full(len(delta), np.inf), where=previous != 0)
+        changed |= delta != 0
+        flagged |= (np.abs(delta) >= min_change) & (percent >= min_change_pct)
+    programs = programs.assign(change=np.select([~programs['in_before'].to_numpy(), ~programs['in_after'].to_numpy(), changed], ['program added', 'program removed', 'changed'], ''), flagged=flagged,
+                               largest_delta=-programs[[f'{measure}_delta' for measure in diff_measures]].abs().max(axis=1))
+    program_changes = programs[programs['change'] != ''].sort_values(['comparison', 'flagged', 'largest_delta'], ascending=[True, False, True], kind='stable')
+    program_changes = program_changes[employee_keys[1:] + ['employee_name', 'program', 'change'] + [f'{measure}_{part}' for measure in diff_measures for part in ['before', 'after', 'delta']] + ['flagged']]
+    return employee_changes.reset_index(drop=True), program_changes.reset_index(drop=True)
+
+
+def diff_results(previous_period, previous, period, result, min_change=default_min_change, min_change_pct=default_min_change_pct):
+    # period_diff of two PayrollResults
+    import pandas as pd
+
+    previous_allocations, previous_employees = result_frames(previous_period, previous)
+    allocations, employees = result_frames(period, result)
+    return period_diff(pd.concat([previous_allocations, allocations], ignore_index=True), pd.concat([previous_employees, employees], ignore_index=True),
+                       [(previous_period, period)], min_change, min_change_pct)
+
+
+def print_period_diff(employee_changes, program_changes, pairs, flagged_only=False):
+    if flagged_only:
+        program_changes = program_changes[program_changes['flagged']]
+    if not pairs:
+        print("\nNothing to compare.")
+    for previous_period, period in pairs:
+        employee_rows = employee_changes[(employee_changes['previous_period'] == previous_period) & (employee_changes['period'] == period)].drop(columns=diff_keys)
+        program_rows = program_changes[(program_changes['previous_period'] == previous_period) & (program_changes['period'] == period)].drop(columns=diff_keys)
+        print(f"\nCHANGES FROM {previous_period} TO {period}: {len(employee_rows)} employees, {len(program_rows)} programs ({int(program_rows['flagged'].sum())} flagged)")
+        if len(employee_rows):
+            print(f"\n{employee_rows.fillna({'department_before': '', 'department_after': ''}).round(2).to_string(index=False)}")
+        if len(program_rows):
+            program_rows = program_rows.assign(flagged=program_rows['flagged'].map({True: '<<', False: ''}))
+            print(f"\n{program_rows.round(2).to_string(index=False)}")
+
+
+# OUTPUT FILES: the allocation as CSV, JSON lines or Parquet, written a chunk of rows at a time as each
+# register is finished instead of collected into one DataFrame, so a batch of any size stays in bounded memory.
+output_formats = ['csv', 'json', 'parquet']
+
+output_extensions = {'csv': '.csv', 'json': '.jsonl', 'parquet': '.parquet'}
+
+# every output file and its columns. The money columns are floats, the rest are text
+output_tables = {
+    'employee_allocations': ['period', 'employee_number', 'employee_name', 'program'] + allocation_measures,
+    'program_totals': ['period', 'program'] + allocation_measures,
+    'reconciliation': ['period', 'total', 'calculated', 'stated', 'matches'],
+}
+
+# rows handed to the Parquet writer at once, each chunk becomes a row group
+parquet_chunk_rows = 64 * 1024
+
+
+class CsvOutput:
+    def __init__(self, path, columns):
+        import csv
+
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesOutput:
+    # one JSON object per line, pandas.read_json(path, lines=True) reads it back
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def write_rows(self, rows):
+        columns = self.columns
+        self.file.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([(column, pa.float64() if column in allocation_measures or column in ('calculated', 'stated') else pa.bool_() if column == 'matches' else pa.string()) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, parquet_chunk_rows))
+            if not chunk:
+                break
+            columns = [list(column) for column in zip(*chunk)]
+            self.writer.write_table(self.pa.Table.from_arrays([self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+output_classes = {'csv': CsvOutput, 'json': JsonLinesOutput, 'parquet': ParquetOutput}
+
+
+def missing_output_dependency(output_format):
+    # the package an output format needs that isn't installed, or None
+    if output_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        return 'pyarrow'
+    return None
+
+
+class AllocationOutput:
+    # The three output files for a run, opened together and written one register at a time.
+    # Use it as a context manager so the files are closed (and Parquet footers written) on errors too.
+    def __init__(self, output_base, output_format='csv'):
+        self.paths = {table: f"{output_base}_{table}{output_extensions[output_format]}" for table in output_tables}
+        self.outputs = {}
+        try:
+            for table, columns in output_tables.items():
+                self.outputs[table] = output_classes[output_format](self.paths[table], columns)
+        except Exception:
+            self.close()
+            raise
+
+    def write(self, period, by_program, reconciliation, employee_allocations):
+        # the pieces BatchEntry carries, employee_allocations can be a generator
+        self.outputs['employee_allocations'].write_rows((period,) + tuple(row) for row in employee_allocations)
+        self.outputs['program_totals'].write_rows((period, program) + tuple(by_program[measure][program] for measure in allocation_measures) for program in by_program.get('gross', {}))
+        self.outputs['reconciliation'].write_rows((period, name, calculated, stated, calculated is not None and stated is not None and round(calculated, 2) == round(stated, 2)) for name, calculated, stated in reconciliation)
+
+    def write_result(self, period, result):
+        self.write(period, result_by_program(result), result.reconciliation(), employee_allocation_rows(result))
+
+    def close(self):
+        for output in self.outputs.values():
+            output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def print_saved_outputs(output):
+    print(f"\nResults saved to:")
+    for path in output.paths.values():
+        print(f"\t{path}")
+
+
+# WATCH MODE: a long running process that picks up registers as they land in a folder.
+# A file is processed when its modification time or size changed and its content hash differs from the last time
+# it was processed, so touching or copying a register over itself doesn't process it again. What was processed
+# is kept in a state file in the folder, so a restarted watcher carries on where it left off.
+watch_state_name = '.WageDistribution-watch.json'
+watch_log_name = 'WageDistribution-watch.log'
+
+
+def warm_worker():
+    # Run once in every worker process, so the first register a worker gets doesn't pay for these imports.
+    # Ctrl+C reaches the workers too, they leave it to the watcher, which shuts them down.
+    import signal
+
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class FolderWatcher:
+    # Use it as a context manager, the worker pool is started on entry and lives until exit.
+    def __init__(self, folder, rules_path, engine='auto', workers=None, cache=None, output_dir=None, output_format=None, store=None,
+                 settle_seconds=5, status_log=None, layouts=None):
+        self.folder = os.path.abspath(folder)  # the state is keyed by absolute path, so it doesn't matter where we are started from
+        self.rules_path = rules_path
+        self.engine = engine
+        self.workers = workers
+        self.cache = cache
+        self.layouts = layouts
+        self.output_dir = output_dir or self.folder
+        self.output_format = output_format
+        self.store = store
+        self.settle_seconds = settle_seconds  # files modified more recently than this may still be being copied in
+        self.status_log = status_log or os.path.join(self.folder, watch_log_name)
+        self.state_path = os.path.join(self.folder, watch_state_name)
+        self.state = self.load_state()
+        self.executor = None
+        self.not_recorded = set()  # registers of the current poll that the store couldn't take
+
+    def load_state(self):
+        # {path: {'mtime_ns', 'size', 'sha256', 'status'}} for every register processed before
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # a damaged state file means processing everything again, which is safe
+            return {}
+
+    def save_state(self):
+        temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as state_file:
+            json.dump(self.state, state_file, indent=1)
+        os.replace(temp_path, self.state_path)
+
+    def log(self, event, path, detail):
+        # one tab separated line per file: time, processed / skipped / failed / removed, file, details
+        from datetime import datetime
+
+        line = f"{datetime.now().isoformat(timespec='seconds')}\t{event}\t{path}\t{detail}"
+        print(line)
+        with open(self.status_log, 'a') as log_file:
+            log_file.write(line + "\n")
+
+    def changed_registers(self):
+        # [(path, stat, sha256)] of the registers that need processing. Also forgets registers that were removed.
+        now = time.time()
+        changed = []
+        state_changed = False
+        seen = set()
+        for path in find_registers(self.folder):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen.add(path)
+            known = self.state.get(path)
+            if known is not None and known['mtime_ns'] == stat.st_mtime_ns and known['size'] == stat.st_size:
+                continue
+            if now - stat.st_mtime < self.settle_seconds:
+                continue
+            try:
+                sha256 = file_content_hash(path).hexdigest()
+            except OSError as e:
+                self.log('failed', path, f"unreadable: {e}")
+                continue
+            if known is not None and known['sha256'] == sha256:
+                known.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                state_changed = True
+                self.log('skipped', path, 'content unchanged since it was processed')
+                continue
+            changed.append((path, stat, sha256))
+
+        for path in sorted(set(self.state) - seen):
+            del self.state[path]
+            state_changed = True
+            self.log('removed', path, 'no longer in the folder')
+        if state_changed:
+            self.save_state()
+        return changed
+
+    def finish_entry(self, entry):
+        # write out and record each register as soon as it is done, like --batch does
+        failed = entry.status.startswith('failed')
+        with AllocationOutput(os.path.join(self.output_dir, entry.period), self.output_format) if self.output_format and not failed else nullcontext() as output:
+            pay_date = save_batch_entry(entry, output, self.store)
+        if self.store is not None and pay_date is None and not failed:
+            self.not_recorded.add(entry.input_file)
+        return entry._replace(employee_allocations=[], employees=[])
+
+    def poll(self):
+        # process whatever changed since the last poll. Returns its BatchEntry list, in file name order.
+        changed = self.changed_registers()
+        if not changed:
+            return []
+        start = time.perf_counter()
+        self.not_recorded.clear()
+        entries = run_batch([path for path, _, _ in changed], self.rules_path, engine=self.engine, cache=self.cache,
+                            with_employees=bool(self.output_format or self.store), on_entry=self.finish_entry, executor=self.executor, layouts=self.layouts)
+        seconds = time.perf_counter() - start
+        for (path, stat, sha256), entry in zip(changed, entries):
+            self.state[path] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256, 'status': entry.status}
+            detail = f"{entry.status}, not recorded in the store: no pay date in the file name" if path in self.not_recorded else entry.status
+            self.log('failed' if entry.status.startswith('failed') else 'processed', path, detail)
+        self.save_state()
+        print(f"Processed {len(entries)} registers in {seconds:.2f}s")
+        return entries
+
+    def run(self, poll_seconds=10):
+        # poll until interrupted
+        while True:
+            self.poll()
+            time.sleep(poll_seconds)
+
+    def __enter__(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(cancel_futures=True)
+        self.executor = None
+
+
+def build_arg_parser():
+    # Create an argument parser
+    parser = argparse.ArgumentParser(description='Process Excel file and save results as CSV.')
+
+    # Add the input file argument
+    parser.add_argument('input_file', help='Path to the input Excel file, a directory or glob of them with --batch, or the directory to watch with --watch')
+    parser.add_argument('--rules', default=None, help='Path to the category -> program rules file (defaults to WageDistributionRules.json next to this script)')
+    parser.add_argument('--engine', choices=['auto', 'calamine', 'openpyxl', 'pandas'], default='auto', help='How to read the workbook. auto uses calamine when installed, then the openpyxl row iterator for .xlsx files, then pandas.read_excel')
+    parser.add_argument('--batch', action='store_true', help='Process every register in a directory (or matching a glob) on a process pool')
+    parser.add_argument('--watch', action='store_true', help='Keep watching the input directory and process every register that is new or changed, on a pool of worker processes that stay up')
+    parser.add_argument('--watch-once', action='store_true', help='Like --watch, but process what is new or changed once and exit')
+    parser.add_argument('--poll-seconds', type=float, default=10, help='How often --watch looks for new or changed registers (default: %(default)s)')
+    parser.add_argument('--settle-seconds', type=float, default=5, help='--watch leaves a register alone until it has not been modified for this long, so files still being copied in are not read (default: %(default)s)')
+    parser.add_argument('--status-log', default=None, help=f'Where --watch logs processed, skipped and failed files (default: {watch_log_name} in the watched directory)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for --batch and --watch (defaults to the number of CPUs)')
+    parser.add_argument('--parse-workers', type=int, default=None, help='Parse the employee blocks of a single register on this many processes, for very large registers (default: one pass on this process)')
+    parser.add_argument('--layout', choices=['auto', 'fixed'], default='fixed', help='fixed reads the built-in columns. auto finds the columns from the first employee and marker rows of each register, caching them by header so registers laid out the same skip it (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=default_cache_dir, help='Where parsed registers are cached (default: %(default)s)')
+    parser.add_argument('--cache-size-mb', type=float, default=256, help='Largest the cache may grow before the least recently used entries are removed (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the parse cache')
+    parser.add_argument('--refresh-cache', action='store_true', help='Ignore cached entries and parse the workbook again, replacing what is cached')
+    parser.add_argument('--clear-cache', action='store_true', help='Remove every cached entry before running')
+    parser.add_argument('--store', nargs='?', const=default_store_file, default=None, help=f'Record the allocation in the year to date store, replacing what was recorded for the same pay period before (default store: {default_store_file})')
+    parser.add_argument('--period', default=None, help='Name of the pay period to record (defaults to the file name)')
+    parser.add_argument('--pay-date', default=None, help='Pay date of the period to record, YYYY-MM-DD (defaults to a date found in the file name)')
+    parser.add_argument('--scenarios', default=None, help='Instead of the report, compare the allocation under every rule scenario in this file with the rules file, per program')
+    parser.add_argument('--diff', default=None, metavar='PREVIOUS_REGISTER', help='Instead of the report, list what changed since this earlier register: new and terminated employees, default departments, programs and large swings in pay')
+    parser.add_argument('--min-change', type=float, default=default_min_change, help='--diff flags a program whose gross or net pay moved by at least this many dollars (default: %(default)s)')
+    parser.add_argument('--min-change-pct', type=float, default=default_min_change_pct, help='... and by at least this percent of what it was (default: %(default)s)')
+    parser.add_argument('--flagged-only', action='store_true', help='--diff only lists the flagged program changes')
+    parser.add_argument('--format', choices=output_formats, default=None, help='Also write the per-employee allocations, per-program totals and reconciliation to files in this format')
+    parser.add_argument('--output', default=None, help='Start of the output file names, _employee_allocations.csv and so on is added (defaults to the input file without its extension, or "batch" in the input directory). With --watch, the directory the output files of each register go in (defaults to the watched directory)')
+    parser.add_argument('--profile', nargs='?', const='table', choices=['table', 'json'], default=None, help='After the report, print the time spent in each stage and hot-path counters as a table (default) or JSON')
+    parser.add_argument('--validate', action='store_true', help='Only check that the input file and rules file can be found and the rules file is valid, without reading the workbook')
+    return parser
+
+
+def main(argv=None):
+    # Parse the command-line arguments
+    args = build_arg_parser().parse_args(argv)
+
+    # category -> program rules, compiled once
+    rules_path = args.rules or default_rules_file
+    try:
+        rules = AllocationRules.load(rules_path)
+    except FileNotFoundError:
+        print(f"Error: The rules file '{rules_path}' was not found.")
+        return 1
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Error: The rules file '{rules_path}' is not valid: {e}")
+        return 1
+
+    if args.format and missing_output_dependency(args.format):
+        print(f"Error: --format {args.format} needs {missing_output_dependency(args.format)}, install it with pip install {missing_output_dependency(args.format)}")
+        return 1
+
+    # flags that don't go with the mode asked for, checked before any mode runs
+    if args.watch or args.watch_once:
+        if args.batch or args.period or args.pay_date or args.scenarios or args.diff or args.profile or args.parse_workers:
+            print("Error: --watch processes each register like --batch, --batch, --period, --pay-date, --scenarios, --diff, --profile and --parse-workers don't apply.")
+            return 1
+    elif args.batch:
+        if args.period or args.pay_date:
+            print("Error: --period and --pay-date are for a single register, in --batch mode they come from each file name.")
+            return 1
+        if args.scenarios or args.diff or args.profile or args.parse_workers:
+            print("Error: --scenarios, --diff, --profile and --parse-workers are for a single register, they don't apply to --batch.")
+            return 1
+    elif args.diff:
+        if args.scenarios or args.store or args.format or args.profile:
+            print("Error: --diff only lists the changes between two registers, --scenarios, --store, --format and --profile don't apply.")
+            return 1
+
+    cache = None
+    if not args.no_cache:
+        cache = ParseCache(args.cache_dir, max_bytes=int(args.cache_size_mb * 1024 * 1024), refresh=args.refresh_cache)
+        if args.clear_cache:
+            cache.clear()
+    # detected layouts are kept next to the parse cache, even with --no-cache since they are tiny
+    layouts = LayoutCache(os.path.join(args.cache_dir, layout_cache_name)) if args.layout == 'auto' else None
+
+    if args.watch or args.watch_once:
+        if not os.path.isdir(args.input_file):
+            print(f"Error: The directory '{args.input_file}' was not found.")
+            return 1
+        if args.validate:
+            print(f"OK: '{args.input_file}' and '{rules_path}' look good.")
+            return 0
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        store = PayrollStore(args.store) if args.store else None
+        watcher = FolderWatcher(args.input_file, rules_path, engine=args.engine, workers=args.workers, cache=cache, output_dir=args.output, output_format=args.format,
+                                store=store, settle_seconds=args.settle_seconds, status_log=args.status_log, layouts=layouts)
+        with watcher:
+            if args.watch_once:
+                entries = watcher.poll()
+                return 0 if all(entry.status == 'ok' for entry in entries) else 1
+            print(f"Watching '{args.input_file}' every {args.poll_seconds:g}s, press Ctrl+C to stop. Status log: {watcher.status_log}")
+            try:
+                watcher.run(args.poll_seconds)
+            except KeyboardInterrupt:
+                print("Stopped watching.")
+        return 0
+
+    if args.batch:
+        paths = find_registers(args.input_file)
+        if not paths:
+            print(f"Error: No registers found in '{args.input_file}'.")
+            return 1
+        if args.validate:
+            print(f"OK: {len(paths)} registers and '{rules_path}' look good.")
+            return 0
+        store = PayrollStore(args.store) if args.store else None
+        recorded = []
+
+        def finish_entry(entry):
+            # record and write out each register as soon as it is done, then drop its employee rows
+            if save_batch_entry(entry, output, store) is not None:
+                recorded.append(entry.period)
+            elif store is not None and not entry.status.startswith('failed'):
+                print(f"Warning: No pay date in '{entry.period}', it was not recorded in the store.")
+            return entry._replace(employee_allocations=[], employees=[])
+
+        batch_start = time.perf_counter()
+        output_base = args.output or os.path.join(args.input_file if os.path.isdir(args.input_file) else os.path.dirname(args.input_file), 'batch')
+        with AllocationOutput(output_base, args.format) if args.format else nullcontext() as output:
+            entries = run_batch(paths, rules_path, engine=args.engine, workers=args.workers, cache=cache, with_employees=bool(store or output), on_entry=finish_entry, layouts=layouts)
+        print(f"Processed {len(paths)} registers in {time.perf_counter() - batch_start:.2f}s")
+        print_batch_report(entries)
+        if store is not None:
+            print(f"\nRecorded {len(recorded)} pay periods in '{args.store}'")
+        if output is not None:
+            print_saved_outputs(output)
+        return 0 if all(entry.status == 'ok' for entry in entries) else 1
+
+    if not os.path.isfile(args.input_file):
+        print(f"Error: The file '{args.input_file}' was not found.")
+        return 1
+
+    if args.validate:
+        print(f"OK: '{args.input_file}' and '{rules_path}' look good.")
+        return 0
+
+    if args.diff:
+        if not os.path.isfile(args.diff):
+            print(f"Error: The file '{args.diff}' was not found.")
+            return 1
+
+    if args.store:
+        period = args.period or os.path.splitext(os.path.basename(args.input_file))[0]
+        pay_date = args.pay_date or pay_date_from_name(period)
+        if pay_date is None:
+            print(f"Error: No pay date in '{period}', use --pay-date YYYY-MM-DD to record it in the store.")
+            return 1
+        if pay_date_from_name(pay_date) != pay_date:
+            print(f"Error: '{pay_date}' is not a YYYY-MM-DD pay date.")
+            return 1
+
+    profiler = Profiler() if args.profile else None
+
+    if args.scenarios:
+        try:
+            scenarios = load_scenarios(args.scenarios, rules)
+        except FileNotFoundError:
+            print(f"Error: The scenarios file '{args.scenarios}' was not found.")
+            return 1
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Error: The scenarios file '{args.scenarios}' is not valid: {e}")
+            return 1
+        try:
+            parsed = read_payroll(args.input_file, engine=args.engine, cache=cache, profiler=profiler, parse_workers=args.parse_workers, layouts=layouts)
+        except (ValueError, zipfile.BadZipFile) as e:
+            print(f"Error: '{args.input_file}' could not be processed: {e}")
+            return 1
+        print(f"Loaded '{args.input_file}' with {parsed.load_engine} in {parsed.load_seconds:.2f}s")
+        with profile_stage(profiler, 'scenarios'):
+            baseline, results = evaluate_scenarios(parsed, rules, scenarios)
+            print_scenario_report(baseline, results)
+        if args.profile == 'json':
+            print(json.dumps(profiler.summary(), indent=2))
+        elif args.profile == 'table':
+            print(f"\nPROFILE:\n")
+            print(profiler.format_table())
+        return 0
+
+    if args.diff:
+        try:
+            previous = process_payroll(args.diff, rules, engine=args.engine, cache=cache, parse_workers=args.parse_workers, layouts=layouts)
+            result = process_payroll(args.input_file, rules, engine=args.engine, cache=cache, parse_workers=args.parse_workers, layouts=layouts)
+        except (ValueError, zipfile.BadZipFile) as e:
+            print(f"Error: The registers could not be processed: {e}")
+            return 1
+        period = args.period or os.path.splitext(os.path.basename(args.input_file))[0]
+        previous_period = os.path.splitext(os.path.basename(args.diff))[0]
+        if previous_period == period:
+            previous_period = f"{previous_period} (previous)"
+        employee_changes, program_changes = diff_results(previous_period, previous, period, result, args.min_change, args.min_change_pct)
+        print_period_diff(employee_changes, program_changes, [(previous_period, period)], args.flagged_only)
+        return 0
+
+    # Load the Excel file
+    try:
+        result = process_payroll(args.input_file, rules, engine=args.engine, cache=cache, profiler=profiler, parse_workers=args.parse_workers, layouts=layouts)
+    except FileNotFoundError:
+        print(f"Error: The file '{args.input_file}' was not found.")
+        return 1
+    except (ValueError, zipfile.BadZipFile) as e:
+        print(f"Error: '{args.input_file}' could not be processed: {e}")
+        return 1
+
+    print(f"Loaded '{args.input_file}' with {result.load_engine} in {result.load_seconds:.2f}s")
+    with profile_stage(profiler, 'report'):
+        for message in result.messages:
+            print(message)
+        print_report(result)
+
+    if args.store:
+        with profile_stage(profiler, 'store'):
+            PayrollStore(args.store).record_result(period, pay_date, result)
+        print(f"\nRecorded pay period '{period}' ({pay_date}) in '{args.store}'")
+
+    if args.format:
+        with profile_stage(profiler, 'write_output'):
+            with AllocationOutput(args.output or os.path.splitext(args.input_file)[0], args.format) as output:
+                output.write_result(args.period or os.path.splitext(os.path.basename(args.input_file))[0], result)
+        print_saved_outputs(output)
+
+    if args.profile == 'json':
+        print(json.dumps(profiler.summary(), indent=2))
+    elif args.profile == 'table':
+        print(f"\nPROFILE:\n")
+        print(profiler.format_table())
+    # a hard pass or fail, same as --batch
+    return 0 if result.reconciles() else 1
+
+
+if __name__ == '__main__':
+    exit(main())